@@ -0,0 +1,46 @@
+import argparse
+import time
+from datetime import date
+
+import synthetic
+
+def sequential(records):
+    manager = synthetic.catalogue()
+    begin = time.perf_counter()
+    for record in records:
+        manager.add_reservation(
+            date.fromisoformat(record["start"]),
+            date.fromisoformat(record["end"]),
+            record["location"],
+            record["optionals"]
+        )
+    return manager, time.perf_counter() - begin
+
+def bulk(records):
+    manager = synthetic.catalogue()
+    begin = time.perf_counter()
+    manager.add_reservations_bulk(records)
+    return manager, time.perf_counter() - begin
+
+def snapshot(manager):
+    return [(r.id, r.start, r.end) for r in manager.reservations]
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare add_reservations_bulk with a loop of add_reservation")
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--horizon", type=int, default=None, help="days the start dates are spread over (default: 2 * count)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    horizon = args.horizon or 2 * args.count
+    records = synthetic.records(synthetic.catalogue(), args.count, horizon, seed=args.seed)
+    one, one_time = sequential(records)
+    many, many_time = bulk(records)
+    print(f"records: {args.count}")
+    print(f"sequential: {one_time:.3f}s ({one_time / args.count * 1e6:.1f} us/reservation)")
+    print(f"bulk: {many_time:.3f}s ({many_time / args.count * 1e6:.1f} us/reservation)")
+    print(f"speedup: {one_time / many_time:.2f}x")
+    print(f"identical: {snapshot(one) == snapshot(many)}")
+
+if __name__ == "__main__":
+    main()
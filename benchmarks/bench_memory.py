@@ -0,0 +1,44 @@
+import argparse
+import tracemalloc
+from datetime import date
+
+import synthetic
+from reservation import ReservationTable
+
+def measure(build):
+    tracemalloc.start()
+    value = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, size
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-reservation memory of the dict, slots and columnar representations")
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    manager = synthetic.catalogue()
+    records = synthetic.records(manager, args.count, 2 * args.count, seed=args.seed)
+    for i, record in enumerate(records):
+        record["ID"] = f"RES-{i + 1:03d}"
+
+    _, dicts = measure(lambda: [
+        {
+            "ID": record["ID"],
+            "start": date.fromisoformat(record["start"]),
+            "end": date.fromisoformat(record["end"]),
+            "location": record["location"],
+            "optionals": list(record["optionals"])
+        }
+        for record in records
+    ])
+    reservations, slots = measure(lambda: [manager.decode(record) for record in records])
+    _, columns = measure(lambda: ReservationTable(manager.location_ids, manager.resource_ids, reservations))
+
+    print(f"reservations: {args.count}")
+    for name, size in (("dict", dicts), ("slots", slots), ("columnar", columns)):
+        print(f"{name}: {size / args.count:.1f} bytes/reservation")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import synthetic
+
+async def request(reader : asyncio.StreamReader, writer : asyncio.StreamWriter, method : str, path : str, body = None):
+    content = json.dumps(body).encode("utf-8") if body is not None else b""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(content)}\r\n\r\n".encode("latin-1") + content
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+async def client(host : str, port : int, work : list, latencies : dict[str, list[float]]):
+    reader, writer = await asyncio.open_connection(host, port)
+    for kind, method, path, body in work:
+        begin = time.perf_counter()
+        await request(reader, writer, method, path, body)
+        latencies[kind].append(time.perf_counter() - begin)
+    writer.close()
+
+def workload(count : int, mix : dict[str, float], seed : int):
+    manager = synthetic.catalogue()
+    records = synthetic.records(manager, count, 2 * count, seed=seed)
+    rng = random.Random(seed)
+    kinds = list(mix)
+    work = []
+    for record in records:
+        kind = rng.choices(kinds, weights=[mix[kind] for kind in kinds])[0]
+        if kind == "add":
+            work.append((kind, "POST", "/reservations", record))
+        elif kind == "quote":
+            work.append((kind, "POST", "/quote", record))
+        else:
+            end = date.fromisoformat(record["start"]) + timedelta(days=7)
+            work.append((kind, "GET", f"/reservations?start={record['start']}&end={end}&limit=20", None))
+    return work
+
+def percentile(values : list[float], fraction : float):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+async def run(host : str, port : int, work : list, connections : int):
+    latencies = {kind: [] for kind, _, _, _ in work}
+    begin = time.perf_counter()
+    await asyncio.gather(*(client(host, port, work[i::connections], latencies) for i in range(connections)))
+    return latencies, time.perf_counter() - begin
+
+async def wait_for(host : str, port : int, timeout : float = 30):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running reservation service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--spawn", action="store_true", help="start service.py on --port for the run")
+    parser.add_argument("--journal", action="store_true", help="spawn the service with a journal over a copy of save.json")
+    parser.add_argument("--batch", type=int, default=256, help="most bookings the spawned service places in one pass")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--mix", default="add=0.5,quote=0.3,query=0.2", help="share of each request kind")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    mix = {kind: float(share) for kind, share in (item.split("=") for item in args.mix.split(","))}
+    work = workload(args.requests, mix, args.seed)
+    server = None
+    folder = None
+    if args.spawn:
+        command = [sys.executable, os.path.join(synthetic.ROOT, "service.py"), "--host", args.host,
+                   "--port", str(args.port), "--batch", str(args.batch)]
+        if args.journal:
+            # The journal and its snapshots are written next to the save file,
+            # so the run works on a copy.
+            folder = tempfile.mkdtemp()
+            filename = os.path.join(folder, "save.json")
+            shutil.copy(os.path.join(synthetic.ROOT, "save.json"), filename)
+            command += ["--file", filename, "--journal"]
+        server = subprocess.Popen(command, cwd=synthetic.ROOT, stdout=subprocess.DEVNULL)
+    try:
+        asyncio.run(wait_for(args.host, args.port))
+        latencies, elapsed = asyncio.run(run(args.host, args.port, work, args.connections))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        if folder:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    every = [latency for values in latencies.values() for latency in values]
+    print(f"requests: {len(every)} over {args.connections} connections in {elapsed:.2f}s")
+    print(f"throughput: {len(every) / elapsed:.0f} requests/s")
+    print(f"latency: p50 {percentile(every, 0.5) * 1e3:.2f}ms, p99 {percentile(every, 0.99) * 1e3:.2f}ms")
+    for kind, values in latencies.items():
+        print(f"  {kind}: {len(values)} requests, p50 {percentile(values, 0.5) * 1e3:.2f}ms, p99 {percentile(values, 0.99) * 1e3:.2f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime
+
+import synthetic
+from manager import Manager
+
+OPERATIONS = (
+    "add_reservation", "add_reservations_bulk", "calculate_price", "price_many", "find_available_slots",
+    "refresh", "save_json", "load_json", "save_sqlite", "load_sqlite", "save_binary", "load_binary"
+)
+KEY = ("op", "count", "density", "scarcity", "resources", "exclusions", "max_shift")
+
+def measure(setup, run, memory : bool):
+    state = setup()
+    gc.collect()
+    begin = time.perf_counter()
+    run(state)
+    seconds = time.perf_counter() - begin
+    peak = None
+    if memory:
+        # tracemalloc slows allocation down, so memory gets its own pass.
+        state = setup()
+        gc.collect()
+        tracemalloc.start()
+        run(state)
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return seconds, peak
+
+def add_each(state):
+    manager, records = state
+    for record in records:
+        manager.add_reservation(
+            date.fromisoformat(record["start"]),
+            date.fromisoformat(record["end"]),
+            record["location"],
+            record["optionals"]
+        )
+
+def price_each(state):
+    manager, records = state
+    for record in records:
+        manager.calculate_price(
+            date.fromisoformat(record["start"]),
+            date.fromisoformat(record["end"]),
+            record["location"],
+            record["optionals"]
+        )
+
+def search_each(state):
+    manager, records = state
+    for record in records:
+        start = date.fromisoformat(record["start"])
+        manager.find_available_slots(
+            record["location"],
+            record["optionals"],
+            (date.fromisoformat(record["end"]) - start).days + 1,
+            start
+        )
+
+def scenario(count : int, density : float, scarcity : float, resources : int, exclusions : int,
+             max_shift : int | None, operations : list[str], memory : bool, seed : int, folder : str):
+    def fresh():
+        manager = synthetic.catalogue(resources=resources, exclusions=exclusions, scarcity=scarcity, seed=seed)
+        manager.set_shift_policy(max_shift)
+        return manager
+    manager = fresh()
+    # Stays last one to three days long, two on average, spread so that each
+    # location holds about `density` reservations per day.
+    horizon = max(int(count * 2 / (density * len(manager.locations))), 1)
+    records = synthetic.records(manager, count, horizon, seed=seed)
+    full = fresh()
+    placed = full.add_reservations_bulk(records)
+    # Rejected bookings take no ID, so results are matched to records by position.
+    shifted = sum(
+        1 for record, result in zip(records, placed)
+        if result["succeeded"] and result["start"] != date.fromisoformat(record["start"])
+    )
+    rejected = sum(1 for result in placed if not result["succeeded"])
+    paths = {
+        "json": os.path.join(folder, "bench.json"),
+        "sqlite": os.path.join(folder, "bench.db"),
+        "binary": os.path.join(folder, "bench.rmb")
+    }
+
+    def loaded(kind):
+        def setup():
+            full.save(paths[kind])
+            return Manager()
+        return setup
+
+    cases = {
+        "add_reservation": (lambda: (fresh(), records), add_each),
+        "add_reservations_bulk": (lambda: (fresh(), records), lambda state: state[0].add_reservations_bulk(state[1])),
+        "calculate_price": (lambda: (full, records), price_each),
+        "price_many": (lambda: full, lambda manager: manager.price_many()),
+        "find_available_slots": (lambda: (full, records[:1000]), search_each),
+        "refresh": (lambda: full, lambda manager: manager.refresh()),
+        "save_json": (lambda: full, lambda manager: manager.save(paths["json"])),
+        "load_json": (loaded("json"), lambda manager: manager.load(paths["json"], cutoff=date.min)),
+        "save_sqlite": (lambda: full, lambda manager: manager.save(paths["sqlite"])),
+        "load_sqlite": (loaded("sqlite"), lambda manager: manager.load(paths["sqlite"], cutoff=date.min)),
+        "save_binary": (lambda: full, lambda manager: manager.save(paths["binary"])),
+        "load_binary": (loaded("binary"), lambda manager: manager.load(paths["binary"], cutoff=date.min))
+    }
+    results = []
+    for op in operations:
+        setup, run = cases[op]
+        seconds, peak = measure(setup, run, memory)
+        results.append({
+            "op": op,
+            "count": count,
+            "density": density,
+            "scarcity": scarcity,
+            "resources": resources,
+            "exclusions": exclusions,
+            "max_shift": max_shift,
+            "seconds": seconds,
+            "peak_mb": peak,
+            "shifted": shifted,
+            "rejected": rejected
+        })
+        print(format_row(results[-1]), flush=True)
+    return results
+
+def format_row(row : dict, note : str = ""):
+    peak = f"{row['peak_mb']:9.1f}MB" if row["peak_mb"] is not None else "        -  "
+    return (
+        f"{row['op']:<22} n={row['count']:<8} density={row['density']:<5} scarcity={row['scarcity']:<4} "
+        f"resources=+{row['resources']:<3} exclusions=+{row['exclusions']:<4} max_shift={row.get('max_shift')} "
+        f"{row['seconds']:10.4f}s {peak} {note}"
+    ).rstrip()
+
+def compare(results : list[dict], baseline : list[dict], tolerance : float, floor : float):
+    previous = {tuple(row.get(name) for name in KEY): row for row in baseline}
+    regressions = []
+    for row in results:
+        before = previous.get(tuple(row.get(name) for name in KEY))
+        if not before:
+            continue
+        # Very short timings are mostly noise, so they only count above `floor`.
+        slower = row["seconds"] > before["seconds"] * (1 + tolerance) and row["seconds"] - before["seconds"] > floor
+        bigger = (
+            row["peak_mb"] is not None and before.get("peak_mb") is not None
+            and row["peak_mb"] > before["peak_mb"] * (1 + tolerance) and row["peak_mb"] - before["peak_mb"] > 1
+        )
+        if slower or bigger:
+            regressions.append((row, before))
+    return regressions
+
+def values(text : str, kind):
+    return [kind(value) for value in text.split(",")]
+
+def limit(text : str):
+    return None if text == "none" else int(text)
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and peak memory of the scheduling and persistence paths")
+    parser.add_argument("--counts", default="1000,10000", help="comma separated reservation counts, up to 1000000")
+    parser.add_argument("--density", default="0.5", help="reservations per location per day")
+    parser.add_argument("--scarcity", default="1", help="resource quantities are divided by this")
+    parser.add_argument("--resources", default="0", help="synthetic resources added to the catalogue")
+    parser.add_argument("--exclusions", default="0", help="random exclusion pairs added to the catalogue")
+    parser.add_argument("--max-shift", default="none", help="comma separated shift limits in days, none for unbounded")
+    parser.add_argument("--ops", default=",".join(OPERATIONS))
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", default=None, help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown or growth before flagging")
+    parser.add_argument("--floor", type=float, default=0.01, help="seconds a slowdown must exceed to count")
+    args = parser.parse_args()
+
+    operations = args.ops.split(",")
+    for op in operations:
+        if not op in OPERATIONS:
+            parser.error(f"unknown operation {op}, expected one of {', '.join(OPERATIONS)}")
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for count, density, scarcity, resources, exclusions, max_shift in itertools.product(
+            values(args.counts, int), values(args.density, float), values(args.scarcity, float),
+            values(args.resources, int), values(args.exclusions, int), values(args.max_shift, limit)
+        ):
+            results += scenario(count, density, scarcity, resources, exclusions, max_shift, operations,
+                                not args.no_memory, args.seed, folder)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "results": results
+        }, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance, args.floor)
+        for row, before in regressions:
+            print(format_row(row, f"REGRESSION (was {before['seconds']:.4f}s, {before.get('peak_mb') or 0:.1f}MB)"))
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from manager import Manager
+
+def catalogue(filename : str = os.path.join(ROOT, "save.json"), resources : int = 0, exclusions : int = 0,
+              scarcity : float = 1.0, seed : int = 0):
+    manager = Manager()
+    manager.load(filename)
+    manager.reservations = []
+    manager.id_map = {}
+    manager.last_id = 0
+    manager.reindex()
+    rng = random.Random(seed)
+    # Extra resources are offered as optionals everywhere, so they widen both
+    # the bitmasks and the exclusion graph the validator walks.
+    for i in range(resources):
+        name = f"Synthetic {i + 1}"
+        manager.add_resource(name, rng.randint(1, 10), rng.randint(1, 100), [])
+        for location in manager.locations:
+            manager.optionals[location].append(name)
+            manager.link(location)
+    candidates = [
+        (first, second)
+        for i, first in enumerate(manager.resources)
+        for second in manager.resources[i + 1:]
+        if not second in manager.exclusions[first]
+    ]
+    for first, second in rng.sample(candidates, min(exclusions, len(candidates))):
+        manager.exclude(first, second)
+    for name in manager.resources:
+        manager.quantity[name] = max(1, int(manager.quantity[name] / scarcity))
+    return manager
+
+def choose_optionals(manager : Manager, location : str, rng : random.Random):
+    optionals = []
+    for optional in rng.sample(manager.optionals[location], rng.randint(0, len(manager.optionals[location]))):
+        if not any(chosen in manager.exclusions[optional] for chosen in optionals):
+            optionals.append(optional)
+    return optionals
+
+def records(manager : Manager, count : int, horizon : int = 3650, length : int = 3, seed : int = 0):
+    rng = random.Random(seed)
+    first = date.today() + timedelta(days=1)
+    data = []
+    for _ in range(count):
+        start = first + timedelta(days=rng.randrange(horizon))
+        location = rng.choice(manager.locations)
+        data.append({
+            "start": start.isoformat(),
+            "end": (start + timedelta(days=rng.randrange(length))).isoformat(),
+            "location": location,
+            "optionals": choose_optionals(manager, location, rng)
+        })
+    return data
@@ -0,0 +1,180 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from datetime import date
+import numpy as np
+from reservation import code_to_id
+
+BINARY_EXTENSIONS = (".rmb",)
+MAGIC = b"RMSNAP\r\n"
+VERSION = 1
+# magic, version, rows, words per optionals mask, meta length, crc32 of everything after the header
+HEADER = struct.Struct("<8sIQIQI")
+ALIGN = 8
+
+class SnapshotError(ValueError):
+    pass
+
+def padding(length : int):
+    return -length % ALIGN
+
+class Snapshot:
+    # Column views straight over the mapped file, so nothing is copied until
+    # a caller selects rows.
+    def __init__(self, filename : str, verify : bool = True):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.buffer) < HEADER.size:
+            raise SnapshotError(f"{filename} is too short to be a snapshot")
+        magic, version, rows, words, length, checksum = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise SnapshotError(f"{filename} is not a reservation snapshot")
+        if version != VERSION:
+            raise SnapshotError(f"{filename} has snapshot version {version}, expected {VERSION}")
+        if verify and zlib.crc32(memoryview(self.buffer)[HEADER.size:]) != checksum:
+            raise SnapshotError(f"{filename} failed its checksum")
+        offset = HEADER.size
+        self.meta = json.loads(bytes(self.buffer[offset:offset + length]).decode("utf-8"))
+        offset += length + padding(length)
+        self.rows = rows
+        self.words = words
+
+        def column(dtype, count):
+            nonlocal offset
+            array = np.frombuffer(self.buffer, dtype=dtype, count=count, offset=offset)
+            offset += array.nbytes + padding(array.nbytes)
+            return array
+
+        self.ids = column("<i8", rows)
+        self.starts = column("<i4", rows)
+        self.ends = column("<i4", rows)
+        self.location_ids = column("<i4", rows)
+        self.optionals = column("<u8", rows * words).reshape(rows, words)
+
+    def close(self):
+        # The columns are views into the mapping, so they go first.
+        self.ids = self.starts = self.ends = self.location_ids = self.optionals = None
+        self.buffer.close()
+
+    def masks(self, rows = None):
+        # Masks of up to 64 resources stay a uint64 column; wider ones become
+        # Python ints, which is what the rest of the code uses for them.
+        words = self.optionals if rows is None else self.optionals[rows]
+        if self.words == 1:
+            return words[:, 0]
+        if self.words == 0:
+            return np.zeros(len(words), dtype=np.uint64)
+        masks = np.zeros(len(words), dtype=object)
+        for k in range(self.words):
+            masks = masks + (words[:, k].astype(object) << (64 * k))
+        return masks
+
+def remap_masks(masks : np.ndarray, names : list[str], ids : dict[str, int]):
+    # Moves each bit from its position in `names` to the one `ids` gives the
+    # same name, dropping names that are gone.
+    if all(ids.get(name) == i for i, name in enumerate(names)):
+        return masks
+    wide = max(ids.values(), default=0) >= 64
+    masks = masks.astype(object)
+    remapped = np.zeros(len(masks), dtype=object)
+    for i, name in enumerate(names):
+        if name in ids:
+            remapped |= ((masks >> i) & 1) << ids[name]
+    return remapped if wide else remapped.astype(np.uint64)
+
+def encode_masks(masks : np.ndarray, words : int):
+    if words == 1:
+        return np.asarray(masks, dtype="<u8").reshape(-1, 1)
+    optionals = np.zeros((len(masks), words), dtype="<u8")
+    masks = np.asarray(masks, dtype=object)
+    for k in range(words):
+        optionals[:, k] = ((masks >> (64 * k)) & 0xFFFFFFFFFFFFFFFF).astype(np.uint64)
+    return optionals
+
+def write_columns(filename : str, meta : dict, ids, starts, ends, location_ids, optionals : np.ndarray):
+    columns = [
+        np.ascontiguousarray(ids, dtype="<i8"),
+        np.ascontiguousarray(starts, dtype="<i4"),
+        np.ascontiguousarray(ends, dtype="<i4"),
+        np.ascontiguousarray(location_ids, dtype="<i4"),
+        np.ascontiguousarray(optionals, dtype="<u8")
+    ]
+    encoded = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+    parts = [encoded, b"\0" * padding(len(encoded))]
+    for array in columns:
+        parts.append(array.tobytes())
+        parts.append(b"\0" * padding(array.nbytes))
+    checksum = 0
+    for part in parts:
+        checksum = zlib.crc32(part, checksum)
+    header = HEADER.pack(MAGIC, VERSION, len(columns[0]), optionals.shape[1], len(encoded), checksum)
+    temp = filename + ".tmp"
+    try:
+        with open(temp, "wb") as f:
+            f.write(header)
+            for part in parts:
+                f.write(part)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, filename)
+        return True
+    except OSError:
+        if os.path.exists(temp):
+            os.remove(temp)
+        return False
+
+def columns(data : dict):
+    # Names only referenced by reservations still get a slot in the string tables.
+    locations = {name: i for i, name in enumerate(data.get("locations", []))}
+    resources = {name: i for i, name in enumerate(data.get("resources", []))}
+    ids, starts, ends, places, masks = [], [], [], [], []
+    for reserve in data.get("reservations", []):
+        if not reserve["location"] in locations:
+            locations[reserve["location"]] = len(locations)
+        mask = 0
+        for optional in reserve["optionals"]:
+            if not optional in resources:
+                resources[optional] = len(resources)
+            mask |= 1 << resources[optional]
+        ids.append(code_to_id(reserve["ID"]))
+        starts.append(date.fromisoformat(reserve["start"]).toordinal())
+        ends.append(date.fromisoformat(reserve["end"]).toordinal())
+        places.append(locations[reserve["location"]])
+        masks.append(mask)
+    masks = np.array(masks, dtype=np.uint64 if len(resources) <= 64 else object)
+    return locations, resources, (np.array(ids, dtype=np.int64), np.array(starts, dtype=np.int32),
+                                  np.array(ends, dtype=np.int32), np.array(places, dtype=np.int32), masks)
+
+def metadata(data : dict, locations : dict[str, int], resources : dict[str, int]):
+    meta = {key: value for key, value in data.items() if key != "reservations"}
+    meta["location_table"] = list(locations)
+    meta["resource_table"] = list(resources)
+    return meta
+
+def save_binary(data : dict, filename : str):
+    locations, resources, (ids, starts, ends, places, masks) = columns(data)
+    words = (len(resources) + 63) // 64
+    return write_columns(filename, metadata(data, locations, resources), ids, starts, ends, places, encode_masks(masks, words))
+
+def load_binary(filename : str):
+    if not os.path.exists(filename):
+        return None
+    snapshot = Snapshot(filename)
+    data = {key: value for key, value in snapshot.meta.items() if not key in ("location_table", "resource_table")}
+    locations, resources = snapshot.meta["location_table"], snapshot.meta["resource_table"]
+    data["reservations"] = []
+    rows = zip(snapshot.ids.tolist(), snapshot.starts.tolist(), snapshot.ends.tolist(),
+               snapshot.location_ids.tolist(), snapshot.masks().tolist())
+    snapshot.close()
+    for id, start, end, location, mask in rows:
+        data["reservations"].append({
+            "ID": f"RES-{id:03d}",
+            "start": date.fromordinal(start).isoformat(),
+            "end": date.fromordinal(end).isoformat(),
+            "location": locations[location],
+            "optionals": [name for index, name in enumerate(resources) if mask >> index & 1]
+        })
+    return data
@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+
+def read_journal(filename: str):
+    if not os.path.exists(filename):
+        return
+    with open(filename, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A crash in the middle of an append leaves a torn last line.
+                return
+            yield entry
+
+class Journal:
+    def __init__(self, filename : str, seq : int = 0):
+        self.filename = filename
+        self.seq = seq
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.file = open(filename, "a", encoding="utf-8")
+
+    def append(self, op : str, args : dict):
+        with self.lock:
+            self.seq += 1
+            self.pending += 1
+            self.file.write(json.dumps({"seq": self.seq, "op": op, "args": args}, ensure_ascii=False) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            return self.seq
+
+    def append_many(self, entries : list[tuple[str, dict]]):
+        # One write and one fsync for the whole batch, so a bulk pass is as
+        # durable as single appends at the cost of one.
+        if not entries:
+            return self.seq
+        with self.lock:
+            lines = []
+            for op, args in entries:
+                self.seq += 1
+                lines.append(json.dumps({"seq": self.seq, "op": op, "args": args}, ensure_ascii=False) + "\n")
+            self.pending += len(entries)
+            self.file.write("".join(lines))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            return self.seq
+
+    def truncate(self, seq : int):
+        with self.lock:
+            entries = [entry for entry in read_journal(self.filename) if entry["seq"] > seq]
+            self.file.close()
+            temp = self.filename + ".tmp"
+            with open(temp, "w", encoding="utf-8") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, self.filename)
+            self.file = open(self.filename, "a", encoding="utf-8")
+
+    def checkpoint(self, data : dict, save, seq : int):
+        if save(data):
+            self.truncate(seq)
+
+    def compact(self, data : dict, save):
+        if self.thread and self.thread.is_alive():
+            return False
+        with self.lock:
+            data["journal_seq"] = self.seq
+            self.pending = 0
+        self.thread = threading.Thread(target=self.checkpoint, args=(data, save, data["journal_seq"]), daemon=True)
+        self.thread.start()
+        return True
+
+    def wait(self):
+        if self.thread:
+            self.thread.join()
+
+    def close(self):
+        self.wait()
+        with self.lock:
+            self.file.close()
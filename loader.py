@@ -1,11 +1,19 @@
 import json
 import os
+import re
+from binary import BINARY_EXTENSIONS, load_binary, save_binary
+
+WHITESPACE = re.compile(r"\s*")
 
 def save_data(data: dict, filename: str):
+    if filename.lower().endswith(BINARY_EXTENSIONS):
+        return save_binary(data, filename)
     temp = filename + ".tmp"
     try:
         with open(temp, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
         os.replace(temp, filename)
         return True
     except:
@@ -17,7 +25,90 @@ def save_data(data: dict, filename: str):
         
 
 def load_data(filename: str):
+    if filename.lower().endswith(BINARY_EXTENSIONS):
+        return load_binary(filename)
     if not os.path.exists(filename):
         return None
     with open(filename, "r", encoding="utf-8") as f:
         return json.load(f)
+
+
+def load_lines(filename: str):
+    with open(filename, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+class Reader:
+    def __init__(self, f, block : int = 1 << 16):
+        self.f = f
+        self.block = block
+        self.buffer = ""
+        self.position = 0
+        self.read = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def more(self):
+        data = self.f.read(self.block)
+        if not data:
+            self.eof = True
+            return False
+        self.read += len(data)
+        self.buffer = self.buffer[self.position:] + data
+        self.position = 0
+        return True
+
+    def peek(self):
+        while True:
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.more():
+                raise ValueError("Unexpected end of file")
+
+    def expect(self, char : str):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.position}")
+        self.position += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # A number cut by the end of the block may continue in the next one.
+                if self.eof or (end < len(self.buffer) and not self.buffer[end] in "0123456789.eE+-"):
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            if not self.more() and self.position >= len(self.buffer):
+                raise ValueError("Unexpected end of file")
+
+def stream_data(filename: str, chunk: int = 1000):
+    size = max(os.path.getsize(filename), 1)
+    with open(filename, "r", encoding="utf-8") as f:
+        reader = Reader(f)
+        reader.expect("{")
+        while reader.peek() != "}":
+            key = reader.value()
+            reader.expect(":")
+            if key == "reservations":
+                reader.expect("[")
+                reservations = []
+                while reader.peek() != "]":
+                    reservations.append(reader.value())
+                    if reader.peek() == ",":
+                        reader.position += 1
+                    if len(reservations) >= chunk:
+                        yield key, reservations, min(reader.read / size, 1.0)
+                        reservations = []
+                reader.position += 1
+                yield key, reservations, min(reader.read / size, 1.0)
+            else:
+                yield key, reader.value(), min(reader.read / size, 1.0)
+            if reader.peek() == ",":
+                reader.position += 1
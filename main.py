@@ -1,14 +1,21 @@
+import json
 import streamlit as st
 import pandas as pd
-from datetime import date
+from datetime import date, timedelta
 from manager import Manager
+from simulation import price_sweep, quantity_sweep, what_if
+
+@st.cache_resource
+def shared_manager():
+    manager = Manager()
+    manager.load("save.json")
+    return manager
 
 class App:
     def __init__(self):
         if "manager" not in st.session_state:
             st.session_state.page = "reserve"
-            st.session_state.manager = Manager()
-            st.session_state.manager.load("save.json")
+            st.session_state.manager = shared_manager()
         self._manager = st.session_state.manager
 
         if "reserve_start" not in st.session_state:
@@ -50,6 +57,9 @@ class App:
             st.session_state.page = "resources"
         if st.sidebar.button("Save and Load"):
             st.session_state.page = "data"
+        if st.sidebar.button("Reports"):
+            st.session_state.page = "reports"
+        self.admin()
 
         if st.session_state.page == "reserve":
             self.reserve()
@@ -61,6 +71,49 @@ class App:
             self.resources()
         elif st.session_state.page == "data":
             self.data()
+        elif st.session_state.page == "reports":
+            self.reports()
+
+    def admin(self):
+        metrics = self._manager.metrics
+        with st.sidebar.expander("Admin: performance"):
+            metrics.enabled = st.checkbox("Collect metrics", value=metrics.enabled)
+            snapshot = metrics.snapshot()
+            if snapshot["timings"]:
+                st.dataframe(pd.DataFrame([
+                    {
+                        "operation": name,
+                        "calls": timing["calls"],
+                        "mean ms": round(timing["mean_ms"], 3),
+                        "p99 ms": round(timing["p99_ms"], 3),
+                        "max ms": round(timing["max_ms"], 3)
+                    }
+                    for name, timing in snapshot["timings"].items()
+                ]), hide_index=True)
+            for name, value in snapshot["counters"].items():
+                st.write(f"{name}: {value}")
+            if "refresh.last" in snapshot["gauges"]:
+                st.write("Last refresh", snapshot["gauges"]["refresh.last"])
+
+            operation = st.selectbox("Profile the next call of", [
+                "add_reservation", "add_reservations_bulk", "delete_reservation", "delete_resource",
+                "delete_location", "update_quantity", "search", "report", "save", "load"
+            ])
+            if st.button("Arm profiler"):
+                metrics.profile(operation)
+            for name in snapshot["profiles"]:
+                with st.popover(f"Profile of {name}"):
+                    st.code(metrics.profiles[name])
+
+            st.download_button(
+                "Download metrics",
+                json.dumps(snapshot, indent=2),
+                file_name="metrics.json",
+                mime="application/json"
+            )
+            if st.button("Reset metrics"):
+                metrics.reset()
+                st.rerun()
 
     def reserve(self):
         st.header("Make a new reservation")
@@ -70,14 +123,40 @@ class App:
                 "Location",
                 self._manager.locations,
             )
-        if location:
+        details = self._manager.location_info(location) if location else None
+        if details:
             optionals = st.multiselect(
                     "Choose the optional resources",
-                    self._manager.optionals[location]
+                    details["optionals"]
                 )
             st.write("Default Resources")
-            for requisite in self._manager.requisites[location]:
+            for requisite in details["requisites"]:
                 st.write(f"- {requisite}")
+            availability = []
+            for resource, free in self._manager.availability(start, end, location).items():
+                info = self._manager.resource_info(resource)
+                if info is None:
+                    continue
+                availability.append(
+                        {
+                            "resource" : resource,
+                            "quantity" : info["quantity"],
+                            "available" : free
+                        }
+                    )
+            st.write("Availability")
+            st.dataframe(pd.DataFrame(availability))
+            if self._manager.booked(start, end, location):
+                st.warning(f"{location} is already booked on these dates, the reservation will be moved")
+            if start <= end:
+                found, slots = self._manager.find_available_slots(location, optionals, (end - start).days + 1, start)
+                st.write("Earliest free dates")
+                if not found:
+                    st.info(slots)
+                elif slots:
+                    st.dataframe(pd.DataFrame(slots))
+                else:
+                    st.info("No free dates within the booking horizon")
             price_value = self._manager.calculate_price(start, end, location, optionals)
             st.text_input("Total price", f"{price_value}", disabled=True)
             if st.button("Add Reservation"):
@@ -89,20 +168,49 @@ class App:
 
     def inspect(self):
         st.header("Search details")
-        if self._manager.reservations:
-            df = pd.DataFrame(self._manager.reservations)
+        search_start = st.date_input("From", value=None)
+        search_end = st.date_input("To", value=None)
+        search_location = st.selectbox(
+                "Location filter",
+                self._manager.locations,
+                index=None,
+                placeholder="All locations"
+            )
+        count = self._manager.count(search_start, search_end, search_location)
+        if count:
+            size = st.selectbox("Rows per page", [25, 50, 100, 500], index=1)
+            pages = (count - 1) // size + 1
+            page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1)
+            reservations = self._manager.search(search_start, search_end, search_location, (page - 1) * size, size)
+            df = pd.DataFrame(reservations)
             st.dataframe(df)
+            st.caption(f"{count} reservations")
+
+            if search_start and search_end and search_start <= search_end:
+                revenue = self._manager.cached(
+                    ("revenue", search_start, search_end, search_location),
+                    lambda: self._manager.revenue(search_start, search_end, search_location)
+                )
+                st.metric("Revenue", int(revenue.sum()))
+                st.bar_chart(revenue)
 
             ids = []
-            for r in self._manager.reservations:
+            for r in reservations:
                 ids.append(r["ID"])
 
-            selected_id = st.selectbox(
-                "Select a reservation to view details",
-                ids
-            )
-    
-            selected = self._manager.id_map[selected_id]
+            typed_id = st.text_input("Find reservation by ID", placeholder="RES-001")
+            if typed_id:
+                selected_id = typed_id.strip().upper()
+            else:
+                selected_id = st.selectbox(
+                    "Select a reservation to view details",
+                    ids
+                )
+
+            try:
+                selected = self._manager.get(selected_id)
+            except ValueError:
+                selected = None
 
             #start = st.date_input("Start Date", value=selected['start'])
             #end = st.date_input("End Date", value=selected['end'])
@@ -113,7 +221,8 @@ class App:
                 st.write(f"**Start Date:** {selected['start']}")
                 st.write(f"**End Date** {selected['end']}")
                 st.write(f"**Location** {selected['location']}")
-                st.write(f"**Requires:** {", ".join(self._manager.requisites[selected['location']])}") 
+                details = self._manager.location_info(selected["location"])
+                st.write(f"**Requires:** {", ".join(details["requisites"] if details else [])}") 
                 st.write(f"**Price:** : {self._manager.calculate_price(
                     selected["start"],
                     selected["end"],
@@ -121,23 +230,24 @@ class App:
                     selected["optionals"]
                 )}")
 
-            if st.button("Delete Reservation"):
-                self._manager.delete_reservation(selected_id)
-                st.warning("Reservation deleted!")
-                st.rerun()
+                if st.button("Delete Reservation"):
+                    self._manager.delete_reservation(selected["ID"])
+                    st.warning("Reservation deleted!")
+                    st.rerun()
+            else:
+                st.error(f"Reservation {selected_id} not found")
         else:
             st.info("No reservations yet.")
 
     def locations(self):
         st.header("Edit locations")
-        data = []
-        for location in self._manager.locations:
-            data.append(
-                    {
-                        "location": location,
-                        "price": self._manager.price[location],
-                    }
-                )
+        data = self._manager.cached(("locations",), lambda: pd.DataFrame([
+            {
+                "location": location,
+                "price": self._manager.price[location],
+            }
+            for location in self._manager.locations
+        ]))
 
         with st.form("Add location"):
             name = st.text_input("Location Name")
@@ -159,29 +269,31 @@ class App:
                 else:
                     st.error(msg)
                 st.rerun()
-        if data:
-            df = pd.DataFrame(data)
-            st.dataframe(df)
+        if not data.empty:
+            st.dataframe(data)
 
             location = st.selectbox(
                 "Select a location to view details",
                 self._manager.locations
             )
+            details = self._manager.location_info(location)
+            if details is None:
+                return
 
-            price = st.number_input("Price", 0, step=1, value=self._manager.price[location])
-            if price != self._manager.price[location]:
+            price = st.number_input("Price", 0, step=1, value=details["price"])
+            if price != details["price"]:
                 self._manager.update_price(location, price)
                 st.rerun()
 
             related = []
-            for required in self._manager.requisites[location]:
+            for required in details["requisites"]:
                 related.append( 
                         {
                             "resource" : required,
                             "relation" : "required"
                         }
                     )
-            for optional in self._manager.optionals[location]:
+            for optional in details["optionals"]:
                 related.append(
                         {
                             "resource" : optional,
@@ -198,15 +310,14 @@ class App:
 
     def resources(self):
         st.header("Edit resources")
-        data = []
-        for resource in self._manager.resources:
-            data.append(
-                    {
-                        "resource": resource,
-                        "quantity": self._manager.quantity[resource],
-                        "price": self._manager.price[resource],
-                    }
-                )
+        data = self._manager.cached(("resources",), lambda: pd.DataFrame([
+            {
+                "resource": resource,
+                "quantity": self._manager.quantity[resource],
+                "price": self._manager.price[resource],
+            }
+            for resource in self._manager.resources
+        ]))
         with st.form("Add resource"):
             name = st.text_input("Resource Name")
             quantity = st.number_input("Quantity", min_value=0, step=1)
@@ -221,27 +332,68 @@ class App:
                 else:
                     st.error(msg)
                 st.rerun()
-        if data:
-            df = pd.DataFrame(data)
-            st.dataframe(df)
+        with st.expander("Scheduling policy"):
+            max_shift = st.number_input(
+                "Most days a reservation may be moved (0 rejects instead of moving, empty for no limit)",
+                min_value=0, step=1, value=self._manager.max_shift
+            )
+            horizon = st.number_input(
+                "Latest start in days from today (empty for no limit)",
+                min_value=0, step=1, value=self._manager.horizon
+            )
+            if max_shift != self._manager.max_shift or horizon != self._manager.horizon:
+                self._manager.set_shift_policy(max_shift, horizon)
+                st.rerun()
+        if self._manager.resources:
+            with st.expander("What-if"):
+                tested = st.selectbox("Resource to test", self._manager.resources, key="what_if_resource")
+                info = self._manager.resource_info(tested)
+                current = info["quantity"] if info else 1
+                first, last = st.slider(
+                    "Quantities to try", 1, max(2 * current, 10), (max(current - 2, 1), current + 2), key="what_if_quantities"
+                )
+                prices = st.text_input("Prices to try (comma separated)", key="what_if_prices")
+                if st.button("Run scenarios"):
+                    try:
+                        values = [int(price) for price in prices.split(",") if price.strip()]
+                    except ValueError:
+                        st.error("Prices must be whole numbers")
+                    else:
+                        scenarios = quantity_sweep(tested, range(first, last + 1)) | price_sweep(tested, values)
+                        with st.spinner("Running scenarios"):
+                            st.session_state.what_if = what_if(self._manager, scenarios)
+                if st.session_state.get("what_if"):
+                    st.dataframe(pd.DataFrame(st.session_state.what_if).drop(columns=["seconds"]))
+        if not data.empty:
+            st.dataframe(data)
 
             resource = st.selectbox(
                 "Select a resource to view details",
                 self._manager.resources
             )
+            details = self._manager.resource_info(resource)
+            if details is None:
+                return
 
-            price = st.number_input("Price", 0, step=1, value=self._manager.price[resource])
-            if price != self._manager.price[resource]:
+            price = st.number_input("Price", 0, step=1, value=details["price"])
+            if price != details["price"]:
                 self._manager.update_price(resource, price)
                 st.rerun()
 
-            quantity = st.number_input("Quantity", 1, step=1, value=self._manager.quantity[resource])
-            if quantity != self._manager.quantity[resource]:
-                self._manager.update_quantity(resource, quantity)
+            quantity = st.number_input("Quantity", 1, step=1, value=details["quantity"])
+            if quantity != details["quantity"]:
+                st.session_state.cascade = self._manager.update_quantity(resource, quantity)
                 st.rerun()
+            cascade = st.session_state.get("cascade")
+            if cascade:
+                st.info(f"Lowering the quantity moved {len(cascade['shifted'])} and rejected {len(cascade['rejected'])} reservations")
+                if cascade["shifted"]:
+                    st.dataframe(pd.DataFrame(cascade["shifted"]))
+                if cascade["rejected"]:
+                    st.dataframe(pd.DataFrame(cascade["rejected"]))
             
             exclusions = []
-            for exclusion in self._manager.exclusions[resource]:
+            for exclusion in details["exclusions"]:
                 exclusions.append( 
                         {
                             "resource" : exclusion,
@@ -256,11 +408,53 @@ class App:
                 self._manager.delete_resource(resource)
                 st.rerun()
 
+    def reports(self):
+        st.header("Reports")
+        report_start = st.date_input("From", value=date.today() - timedelta(days=30), key="report_start")
+        report_end = st.date_input("To", value=date.today() + timedelta(days=60), key="report_end")
+        if not report_start or not report_end or report_start > report_end:
+            st.error("Pick a start date on or before the end date")
+            return
+        report = self._manager.report(report_start, report_end)
+        if not report["reservations"]:
+            st.info("No reservations in this period.")
+            return
+
+        first, second, third = st.columns(3)
+        first.metric("Reservations", report["reservations"])
+        second.metric("Revenue", int(report["revenue"].sum()))
+        if not report["utilization"].empty:
+            third.metric("Mean utilization", f"{report['utilization']['utilization'].mean():.0%}")
+
+        st.subheader("Revenue per day")
+        st.line_chart(report["revenue"])
+
+        st.subheader("Resource utilization")
+        st.bar_chart(report["utilization"]["utilization"])
+        st.dataframe(report["utilization"])
+
+        st.subheader("Location occupancy")
+        st.bar_chart(report["occupancy"]["occupancy"])
+        st.dataframe(report["occupancy"])
+
+        st.subheader("Peak contention days")
+        st.caption("Days where a resource was closest to, or over, its quantity")
+        st.dataframe(report["contention"], hide_index=True)
+
     def data(self):
         st.header("Save & Load")
         load_filename = st.text_input("Load filename", value="save.json")
+        columnar = st.checkbox("Keep past reservations in a compact columnar store")
+        lazy = st.checkbox("Leave past reservations on disk and read them on demand")
         if st.button("Load file"):
-            succeded = self._manager.load(load_filename)
+            bar = st.progress(0.0, text="Loading")
+            succeded = self._manager.load(
+                load_filename,
+                columnar=columnar,
+                lazy=lazy,
+                progress=lambda fraction: bar.progress(fraction, text="Loading")
+            )
+            bar.empty()
             if succeded:
                 st.success("Succeded to load file")
             else:
@@ -275,6 +469,30 @@ class App:
             else:
                 st.error("Failed to save file")
 
+        journal = st.checkbox(
+            "Journal every change to the save file",
+            value=self._manager.journal is not None
+        )
+        if journal and self._manager.journal is None:
+            if self._manager.open_journal(save_filename):
+                st.success(f"Journaling changes to {save_filename}")
+            else:
+                st.error("Failed to open journal")
+        elif not journal and self._manager.journal is not None:
+            self._manager.close_journal()
+
+        import_filename = st.text_input("Import reservations (JSON lines)", value="requests.jsonl")
+        if st.button("Import file"):
+            try:
+                results = self._manager.add_reservations_bulk(import_filename)
+            except (OSError, ValueError):
+                st.error("Failed to import file")
+            else:
+                added = sum(1 for result in results if result["succeeded"])
+                st.success(f"Imported {added} of {len(results)} reservations")
+                if added < len(results):
+                    st.dataframe(pd.DataFrame(results))
+
 if __name__ == "__main__":
     app = App()
     app.render()
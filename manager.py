@@ -1,12 +1,48 @@
 from typing import Any
-from datetime import datetime, date
-from loader import load_data, save_data
+from functools import wraps
+import threading
+from datetime import datetime, date, timedelta
+from bisect import bisect_left, insort
+from heapq import heapify, heappop, heappush
+import numpy as np
+from operator import attrgetter
+from binary import remap_masks
+from loader import load_lines
+from scheduler import Scheduler, occupied
+from journal import Journal, read_journal
+from storage import open_storage
+from pricing import PriceTable
+from reports import ReservationView, summarize
+from rwlock import ReadWriteLock
+from metrics import Metrics
+from reservation import Interner, Reservation, ReservationTable, code_to_id, id_to_code
 
-def code_to_id(code: str) -> int:
-    return int(code.replace("RES-", ""))
+CATALOGUE = ("price", "quantity", "exclusions", "resources", "locations", "requisites", "optionals")
+STATE = CATALOGUE + (
+    "reservations", "location_ids", "resource_ids", "last_id", "id_map",
+    "scheduler", "requiring", "offering", "exclusion_masks", "optional_masks", "journal_seq", "archive", "cutoff", "removed", "tombstones", "touched", "prices",
+    "max_shift", "horizon"
+)
 
-def id_to_code(num: int) -> str:
-    return f"RES-{num:03d}"
+def timed(method):
+    @wraps(method)
+    def measured(self, *args, **kwargs):
+        return self.metrics.call(method.__name__, method, self, *args, **kwargs)
+    return measured
+
+def reads(method):
+    @wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.lock.read():
+            return self.metrics.call(method.__name__, method, self, *args, **kwargs)
+    return locked
+
+def writes(method):
+    @wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.lock.write():
+            return self.metrics.call(method.__name__, method, self, *args, **kwargs)
+    return locked
 
 class Manager:
     def __init__(self):
@@ -17,228 +53,947 @@ class Manager:
         self.locations : list[str] = []
         self.requisites : dict[str, list[str]] = {}
         self.optionals : dict[str, list[str]] = {}
-        self.reservations : list[dict[str, Any]] = []
+        self.reservations : list[Reservation] = []
+
+        self.location_ids = Interner()
+        self.resource_ids = Interner()
+        self.last_id = 0
+        self.id_map : dict[int, Reservation] = {}
+        self.scheduler = Scheduler()
+        self.requiring : dict[str, set[str]] = {}
+        self.offering : dict[str, set[str]] = {}
+        self.exclusion_masks : dict[str, int] = {}
+        self.optional_masks : dict[str, int] = {}
+
+        self.journal : Journal | None = None
+        self.journal_seq = 0
+        self.snapshot = None
+        self.compact_every = 1000
+
+        self.archive = None
+        self.cutoff : int | None = None
+        self.removed : set[int] = set()
+        # Names deleted since the archive was last written. Archived rows of a
+        # tombstoned location stay hidden, and a tombstoned resource stays off
+        # their optionals, even when the same name is added again.
+        self.tombstones : dict[str, set[str]] = {"locations": set(), "resources": set()}
+
+        self.prices : PriceTable | None = None
+        self.view : ReservationView | None = None
+        self.touched : set[int] | None = None
 
-        self.last_id = "RES-0"
-        self.id_map = {}
+        self.max_shift : int | None = None
+        self.horizon : int | None = None
+        self.cascade : dict[str, Any] | None = None
+
+        self.version = 0
+        self.views : dict[tuple, Any] = {}
+        self.views_version = 0
+        self.views_limit = 32
+        self.views_lock = threading.Lock()
+
+        self.lock = ReadWriteLock()
+        self.saving = threading.Lock()
+        self.metrics = Metrics()
     
-    def stock(self, inventory : dict[str , int], reservation : dict[str, Any]):
-        for optional in reservation["optionals"]:
+    def stock(self, inventory : dict[str , int], reservation : Reservation):
+        for optional in self.resource_ids.unmask(reservation.optionals):
             if not optional in inventory:
                 inventory[optional] = 1
             else:
                 inventory[optional] += 1
-        for requisite in self.requisites[reservation["location"]]:
+        for requisite in self.requisites[self.location_ids.names[reservation.location]]:
             if not requisite in inventory:
                 inventory[requisite] = 1
             else:
                 inventory[requisite] += 1
 
-    def insert(self, reservation, reservations : list, property = "start"):
-        first = reservation[property]
-        left, right = 0, len(self.reservations)
-        while left < right:
-            half = (left + right) // 2
-            if first < self.reservations[half][property]:
-                right = half
-            else:
-                left = half + 1
-        reservations.insert(left, reservation)
+    def usage(self, reservation : Reservation):
+        inventory = {}
+        self.stock(inventory, reservation)
+        return inventory
 
-    def refresh(self):
-        collitions = []
-        i = 0
-        while i < len(self.reservations):
-            reservation = self.reservations[i]
-            for j in range(len(collitions) - 1, -1, -1):
-                if collitions[j]["end"] <= reservation["start"]:
-                    collitions = collitions[j + 1:]
-                    break
-            collide = None
-            inventory = {}
-            self.stock(inventory, reservation)
-            for collition in reversed(collitions):
-                if collition["location"] == reservation["location"]:
-                    collide = collition
-                    break
-                else:
-                    self.stock(inventory, collition)
-                    for item in inventory:
-                        if self.quantity[item] < inventory[item]:
-                            collide = collition
-                            break
-                    if collide:
-                        break
-            if collide:
+    def touch(self, ids):
+        # Ids only need tracking once the reports view exists, until then it
+        # is built from scratch anyway.
+        if self.touched is not None:
+            self.touched.update(ids)
+
+    def schedule(self, reservation : Reservation):
+        self.touch((reservation.id,))
+        self.scheduler.add(
+            reservation.id,
+            reservation.start,
+            reservation.end,
+            self.location_ids.names[reservation.location],
+            self.usage(reservation)
+        )
+
+    def schedule_many(self, reservations : list[Reservation]):
+        usages = {}
+        entries = []
+        for reservation in reservations:
+            key = (reservation.location, reservation.optionals)
+            if not key in usages:
+                usages[key] = self.usage(reservation)
+            entries.append((
+                reservation.id,
+                reservation.start,
+                reservation.end,
+                self.location_ids.names[reservation.location],
+                usages[key]
+            ))
+        self.scheduler.add_many(entries)
+
+    def unschedule(self, reservation : Reservation):
+        self.scheduler.remove(
+            reservation.id,
+            reservation.start,
+            reservation.end,
+            self.location_ids.names[reservation.location],
+            self.usage(reservation)
+        )
+
+    def reindex(self):
+        self.scheduler = Scheduler()
+        for reservation in self.reservations:
+            self.schedule(reservation)
+
+    def insert(self, reservation : Reservation, reservations : list, property = "start"):
+        insort(reservations, reservation, key=attrgetter(property))
+
+    def drop(self, dropped : list[Reservation]):
+        # Deleting in place shifts the tail of the list once per reservation, so
+        # large cascades filter the list in a single pass instead.
+        if len(dropped) * 32 < len(self.reservations):
+            for reservation in dropped:
+                i = bisect_left(self.reservations, reservation.start, key=attrgetter("start"))
+                while self.reservations[i] is not reservation:
+                    i += 1
                 del self.reservations[i]
-                reservation["end"] = collide["end"] + (reservation["end"] - reservation["start"])
-                reservation["start"] = collide["end"]
-                self.insert(reservation, self.reservations)
+        elif dropped:
+            ids = {reservation.id for reservation in dropped}
+            self.reservations = [reservation for reservation in self.reservations if not reservation.id in ids]
+        self.scheduler.remove_many([
+            (
+                reservation.id,
+                reservation.start,
+                reservation.end,
+                self.location_ids.names[reservation.location],
+                self.usage(reservation)
+            )
+            for reservation in dropped
+        ])
+        for reservation in dropped:
+            del self.id_map[reservation.id]
+        self.touch(reservation.id for reservation in dropped)
+
+    def link(self, location : str):
+        for requisite in self.requisites[location]:
+            self.requiring.setdefault(requisite, set()).add(location)
+        mask = 0
+        for optional in self.optionals[location]:
+            self.offering.setdefault(optional, set()).add(location)
+            mask |= 1 << self.resource_ids.ids[optional]
+        self.optional_masks[location] = mask
+
+    def unlink(self, location : str):
+        for requisite in self.requisites[location]:
+            self.requiring.get(requisite, set()).discard(location)
+        for optional in self.optionals[location]:
+            self.offering.get(optional, set()).discard(location)
+        self.optional_masks.pop(location, None)
+
+    def exclude(self, first : str, second : str):
+        for one, other in ((first, second), (second, first)):
+            bit = 1 << self.resource_ids.ids[other]
+            if not self.exclusion_masks[one] & bit:
+                self.exclusion_masks[one] |= bit
+                self.exclusions[one].append(other)
+
+    def index_exclusions(self):
+        # Saved exclusion lists may repeat names, name deleted resources or miss
+        # the reverse entry, so they are cleaned up while the bitsets are built.
+        self.exclusion_masks = {name: 0 for name in self.resources}
+        for name in self.resources:
+            self.exclusions[name] = [
+                other for other in dict.fromkeys(self.exclusions.get(name, []))
+                if other in self.exclusion_masks and other != name
+            ]
+            for other in self.exclusions[name]:
+                self.exclusion_masks[name] |= 1 << self.resource_ids.ids[other]
+        for name in self.resources:
+            for other in self.exclusions[name]:
+                self.exclude(name, other)
+        self.exclusions = {name: self.exclusions[name] for name in self.resources}
+
+    def latest(self, start : int):
+        bounds = []
+        if self.max_shift is not None:
+            bounds.append(start + self.max_shift)
+        if self.horizon is not None:
+            bounds.append(datetime.now().date().toordinal() + self.horizon)
+        return min(bounds) if bounds else None
+
+    @timed
+    def refresh(self):
+        # Reservations that already started keep their dates and are indexed
+        # first, only the ones still ahead are placed again around them.
+        today = datetime.now().date().toordinal()
+        self.scheduler = Scheduler()
+        fixed = []
+        queue = []
+        starts = {}
+        limits = {}
+        for reservation in self.reservations:
+            if reservation.start <= today:
+                fixed.append(reservation)
+                continue
+            queue.append((reservation.start, len(queue), reservation))
+            starts[reservation.id] = reservation.start
+            limits[reservation.id] = self.latest(reservation.start)
+        self.schedule_many(fixed)
+        heapify(queue)
+        count = len(queue)
+        self.reservations = list(fixed)
+        rejected = []
+        while queue:
+            start, _, reservation = heappop(queue)
+            end = start + reservation.end - reservation.start
+            location = self.location_ids.names[reservation.location]
+            usage = self.usage(reservation)
+            shift = self.scheduler.collision(start, end, location, usage, self.quantity)
+            if shift is None:
+                reservation.start = start
+                reservation.end = end
+                self.scheduler.add(reservation.id, start, end, location, usage)
+                self.reservations.append(reservation)
+            elif limits[reservation.id] is not None and shift > limits[reservation.id]:
+                # Past its bound the reservation is dropped right away instead of
+                # being pushed again, which caps how long a cascade can run.
+                rejected.append(reservation)
             else:
-                self.insert(reservation, collitions, "end")
-                i += 1
+                heappush(queue, (shift, count, reservation))
+                count += 1
+        for reservation in rejected:
+            del self.id_map[reservation.id]
+        self.touch(reservation.id for reservation in rejected)
+        moves = count - len(self.reservations) + len(fixed) - len(rejected)
+        shifted = [reservation for reservation in self.reservations[len(fixed):] if reservation.start != starts[reservation.id]]
+        self.touch(reservation.id for reservation in shifted)
+        self.metrics.count("refresh.checks", self.scheduler.checks)
+        self.metrics.count("refresh.shifts", moves)
+        self.metrics.count("refresh.shifted", len(shifted))
+        self.metrics.count("refresh.rejected", len(rejected))
+        self.metrics.gauge("refresh.last", {
+            "reservations": len(self.reservations),
+            "checks": self.scheduler.checks,
+            "shifts": moves,
+            "shifted": len(shifted),
+            "rejected": len(rejected)
+        })
+        self.cascade = {
+            "checks": self.scheduler.checks,
+            "shifted": [
+                {
+                    "ID": id_to_code(reservation.id),
+                    "from": date.fromordinal(starts[reservation.id]),
+                    "start": date.fromordinal(reservation.start),
+                    "end": date.fromordinal(reservation.end)
+                }
+                for reservation in shifted
+            ],
+            "rejected": [self.describe(reservation) for reservation in rejected]
+        }
+        return self.cascade
   
-    def add_reservation(self, start : date, end : date, location : str, optionals : list[str]):
+    def validate(self, start : date, end : date, location : str, optionals : list[str]):
+        if not location in self.locations:
+            return f"Validation failed: the location {location} is invalid"
         if start > end:
-            return False, "Validation failed: the start date cannot be after the end date"
+            return "Validation failed: the start date cannot be after the end date"
         elif start < datetime.now().date():
-            return False, "Validation failed: the start date cannot be before the actual date"
-        for i in range(len(optionals)):
-            optional = optionals[i]
-            for j in range(i):
-                if optionals[j] in self.exclusions[optional]:
-                    return False, f"Validation failed: the selected option {optional} excludes {optionals[j]}"
-            if not optional in self.optionals[location]:
-                return False, f"Validation failed: the selected option {optional} is invalid"
-            
-        self.last_id = id_to_code(code_to_id(self.last_id) + 1)
-        _reserve = {
-            "ID": self.last_id,
-            "start": start,
-            "end": end,
-            "location": location,
-            "optionals": optionals
-        }
-        self.id_map[self.last_id] = _reserve
+            return "Validation failed: the start date cannot be before the actual date"
+        offered = self.optional_masks[location]
+        chosen = 0
+        for i, optional in enumerate(optionals):
+            index = self.resource_ids.ids.get(optional)
+            if index is None or not offered >> index & 1:
+                return f"Validation failed: the selected option {optional} is invalid"
+            if self.exclusion_masks[optional] & chosen:
+                for j in range(i):
+                    if self.exclusion_masks[optional] >> self.resource_ids.ids[optionals[j]] & 1:
+                        return f"Validation failed: the selected option {optional} excludes {optionals[j]}"
+            chosen |= 1 << index
+        return None
 
+    def book(self, start : date, end : date, location : str, optionals : list[str]):
+        _reserve = Reservation(
+            self.last_id + 1,
+            start.toordinal(),
+            end.toordinal(),
+            self.location_ids.index(location),
+            self.resource_ids.mask(optionals)
+        )
+        requested, checks = _reserve.start, self.scheduler.checks
+        placed = self.scheduler.place(
+            _reserve.start,
+            _reserve.end,
+            location,
+            self.usage(_reserve),
+            self.quantity,
+            self.latest(requested)
+        )
+        if placed is None:
+            self.metrics.count("booking.rejected")
+            return None
+        self.last_id += 1
+        self.id_map[self.last_id] = _reserve
+        _reserve.start, _reserve.end = placed
+        if _reserve.start != requested:
+            self.metrics.count("booking.collisions", self.scheduler.checks - checks - 1)
+            self.metrics.count("booking.shifted")
+        self.schedule(_reserve)
+        return _reserve
 
+    @writes
+    def add_reservation(self, start : date, end : date, location : str, optionals : list[str]):
+        error = self.validate(start, end, location, optionals)
+        if error:
+            return False, error
+        _reserve = self.book(start, end, location, optionals)
+        if _reserve is None:
+            return False, self.rejection(start)
         self.insert(_reserve, self.reservations)
-        self.refresh()
-        if(_reserve["start"] != start):
-            return True, f"Reservation added in start: {_reserve["start"]}, end: {_reserve["end"]}" 
+        self.log("add_reservation", reservation=self.encode(_reserve))
+        if(_reserve.start != start.toordinal()):
+            return True, f"Reservation added in start: {date.fromordinal(_reserve.start)}, end: {date.fromordinal(_reserve.end)}" 
         return True, "Reservation added!"    
+
+    def rejection(self, start : date):
+        latest = date.fromordinal(self.latest(start.toordinal()))
+        if latest < start:
+            return f"Rejected: the start date is past the booking horizon of {latest}"
+        return f"Rejected: no free slot starting between {start} and {latest}"
+
+    @writes
+    def add_reservations_bulk(self, records):
+        if isinstance(records, str):
+            records = load_lines(records)
+        requests = []
+        for record in records:
+            try:
+                start, end = record["start"], record["end"]
+                if isinstance(start, str):
+                    start = date.fromisoformat(start)
+                if isinstance(end, str):
+                    end = date.fromisoformat(end)
+                location = record["location"]
+                optionals = list(record.get("optionals", []))
+                error = self.validate(start, end, location, optionals)
+            except (KeyError, TypeError, ValueError, AttributeError):
+                start = end = location = optionals = None
+                error = "Validation failed: malformed reservation record"
+            requests.append((start, end, location, optionals, error))
+
+        results = []
+        booked = []
+        for start, end, location, optionals, error in requests:
+            if error:
+                results.append({"succeeded": False, "message": error, "ID": None, "start": None, "end": None})
+                continue
+            _reserve = self.book(start, end, location, optionals)
+            if _reserve is None:
+                results.append({"succeeded": False, "message": self.rejection(start), "ID": None, "start": None, "end": None})
+                continue
+            booked.append(_reserve)
+            first, last = date.fromordinal(_reserve.start), date.fromordinal(_reserve.end)
+            results.append({
+                "succeeded": True,
+                "message": "Reservation added!" if first == start
+                    else f"Reservation added in start: {first}, end: {last}",
+                "ID": id_to_code(_reserve.id),
+                "start": first,
+                "end": last
+            })
+        self.reservations.extend(booked)
+        self.reservations.sort(key=attrgetter("start"))
+        self.version += 1
+        if self.journal:
+            self.journal.append_many([("add_reservation", {"reservation": self.encode(_reserve)}) for _reserve in booked])
+            self.checkpoint()
+        return results
     
-    def delete_reservation(self, id):
-        reservations = []
-        for reservation in self.reservations:
-            if(id != reservation["ID"]):
-                reservations.append(reservation)
-        self.reservations = reservations
-        del self.id_map[id]
+    @writes
+    def delete_reservation(self, id : int | str):
+        if isinstance(id, str):
+            id = code_to_id(id)
+        if not id in self.id_map:
+            if self.archive and self.unarchive(self.archive.get(id_to_code(id))):
+                self.removed.add(id)
+                self.log("delete_reservation", id=id)
+            return
+        self.drop([self.id_map[id]])
+        self.log("delete_reservation", id=id)
 
+    @writes
     def add_resource(self, name : str, quantity : int, price : int, exclusions : list[str]):
         if name in self.resources:
             return False, f"Resource {name} already tracked"
+        for exclusion in exclusions:
+            if not exclusion in self.resources:
+                return False, f"Resource {exclusion} is not tracked"
         self.resources.append(name)
-        self.exclusions[name] = exclusions
-        for exlusion in exclusions:
-            self.exclusions[exlusion].append(name)
+        self.resource_ids.index(name)
+        self.exclusions[name] = []
+        self.exclusion_masks[name] = 0
+        for exclusion in exclusions:
+            self.exclude(name, exclusion)
         self.quantity[name] = quantity
         self.price[name] = price
+        self.prices = None
+        self.log("add_resource", name=name, quantity=quantity, price=price, exclusions=exclusions)
         return True, "Operation Succeded"
     
+    @writes
     def delete_resource(self, name : str):
         if name in self.resources:
-            reservations = []
-            for reservation in self.reservations:
-                location = reservation["location"]
-                if not name in self.requisites[location]:
-                    if name in reservation["optionals"]:
-                        reservation["optionals"].remove(name)
-                    reservations.append(reservation)
-            self.reservations = reservations
-            locations = []
-            for location in self.locations:
-                if not name in self.requisites[location]:
-                    if name in self.optionals[location]:
-                        self.optionals[location].remove(name)
-                    locations.append(location)
+            bit = 1 << self.resource_ids.index(name)
+            required = self.requiring.pop(name, set())
+            dropped = []
+            for key in self.scheduler.resource_keys(name):
+                reservation = self.id_map[key]
+                if self.location_ids.names[reservation.location] in required:
+                    dropped.append(reservation)
                 else:
-                    del self.requisites[location]
-            self.locations = locations
-            del self.exclusions[name]
+                    reservation.optionals &= ~bit
+                    self.touch((reservation.id,))
+            self.drop(dropped)
+            self.scheduler.drop_resource(name)
+            for location in self.offering.pop(name, set()):
+                if not location in required:
+                    self.optionals[location].remove(name)
+                    self.optional_masks[location] &= ~bit
+            self.tombstones["resources"].add(name)
+            self.tombstones["locations"].update(required)
+            for location in required:
+                self.unlink(location)
+                self.scheduler.drop_location(location)
+                del self.requisites[location]
+            if required:
+                self.locations = [location for location in self.locations if not location in required]
+            for other in self.exclusions.pop(name):
+                self.exclusions[other].remove(name)
+                self.exclusion_masks[other] &= ~bit
+            del self.exclusion_masks[name]
             del self.quantity[name]
             del self.price[name]
             self.resources.remove(name)
+            self.prices = None
+            self.log("delete_resource", name=name)
     
+    @writes
     def add_location(self, name : str, price : int, requisites : list[str], optionals : list[str]):
         if name in self.locations:
             return False, f"Location {name} already tracked"
+        for resource in requisites + optionals:
+            if not resource in self.resources:
+                return False, f"Resource {resource} is not tracked"
+        wanted = 0
+        for optional in optionals:
+            wanted |= 1 << self.resource_ids.ids[optional]
         for requisite in requisites:
-            for optional in optionals:
-                if optional in self.exclusions[requisite]:
-                    return False, f"Validation failed: the selected requisite {requisite} excludes {optional}"
+            if self.exclusion_masks[requisite] & wanted:
+                for optional in optionals:
+                    if self.exclusion_masks[requisite] >> self.resource_ids.ids[optional] & 1:
+                        return False, f"Validation failed: the selected requisite {requisite} excludes {optional}"
         self.locations.append(name)
+        self.location_ids.index(name)
         self.price[name] = price
         self.requisites[name] = requisites
         self.optionals[name] = optionals
+        self.link(name)
+        self.prices = None
+        self.log("add_location", name=name, price=price, requisites=requisites, optionals=optionals)
         return True, "Operation Succeded"
     
+    @writes
     def delete_location(self, name : str):
         if name in self.locations:
-            reservations = []
-            for reservation in self.reservations:
-                if reservation["location"] != name:
-                    reservations.append(reservation)
-            self.reservations = reservations
+            self.drop([self.id_map[key] for key in self.scheduler.location_keys(name)])
+            self.scheduler.drop_location(name)
+            self.unlink(name)
+            self.tombstones["locations"].add(name)
             del self.price[name]
             del self.requisites[name]
             del self.optionals[name]
-            self.locations.remove(name) 
+            self.locations.remove(name)
+            self.prices = None
+            self.log("delete_location", name=name)
+
+    @reads
+    def location_info(self, name : str):
+        # Pages of the shared manager read the catalogue through these, so a
+        # name another session just deleted comes back as None.
+        if not name in self.requisites:
+            return None
+        return {"price": self.price[name], "requisites": list(self.requisites[name]), "optionals": list(self.optionals[name])}
+
+    @reads
+    def resource_info(self, name : str):
+        if not name in self.quantity:
+            return None
+        return {"quantity": self.quantity[name], "price": self.price[name], "exclusions": list(self.exclusions[name])}
+
+    @reads
+    def availability(self, start : date, end : date, location : str):
+        free = {}
+        if not location in self.requisites:
+            return free
+        last = occupied(start.toordinal(), end.toordinal())
+        for resource in self.requisites[location] + self.optionals[location]:
+            used = self.scheduler.peak(resource, start.toordinal(), last)
+            free[resource] = max(self.quantity[resource] - used, 0)
+        return free
 
+    @reads
+    def booked(self, start : date, end : date, location : str):
+        return len(self.scheduler.booked(location, start.toordinal(), occupied(start.toordinal(), end.toordinal()))) > 0
+
+    def price_table(self):
+        if self.prices is None:
+            self.prices = PriceTable(self.price, self.requisites, self.location_ids, self.resource_ids)
+        return self.prices
+
+    @reads
+    def report(self, start : date, end : date, top : int = 10):
+        def compute():
+            if self.view is None:
+                self.view = ReservationView()
+            return summarize(self, self.view, start, end, top)
+        return self.cached(("report", start, end, top), compute)
+
+    @reads
     def calculate_price(self, start : date, end : date, location : str, optionals : list[str]):
         delta = (end - start).days + 1
-        total = self.price[location]
-        for requisite in self.requisites[location]:
-            total += self.price[requisite]
+        mask = 0
         for optional in optionals:
-            total += self.price[optional]
-        return total * delta
+            mask |= 1 << self.resource_ids.ids[optional]
+        return self.price_table().daily(self.location_ids.ids[location], mask) * delta
+
+    @reads
+    def quote(self, start : date, end : date, location : str, optionals : list[str]):
+        error = self.validate(start, end, location, optionals)
+        if error:
+            return False, error
+        return True, self.calculate_price(start, end, location, optionals)
 
+    @reads
+    def find_available_slots(self, location : str, optionals : list[str], duration : int, from_date : date, n : int = 5):
+        if duration < 1:
+            return False, "Validation failed: the duration must be at least one day"
+        error = self.validate(from_date, from_date + timedelta(days=duration - 1), location, optionals)
+        if error:
+            return False, error
+        mask = 0
+        for optional in optionals:
+            mask |= 1 << self.resource_ids.ids[optional]
+        probe = Reservation(0, 0, 0, self.location_ids.ids[location], mask)
+        found = self.scheduler.windows(
+            from_date.toordinal(),
+            duration - 1,
+            location,
+            self.usage(probe),
+            self.quantity,
+            n,
+            None if self.horizon is None else datetime.now().date().toordinal() + self.horizon
+        )
+        return True, [
+            {
+                "start": date.fromordinal(first),
+                "end": date.fromordinal(first + duration - 1),
+                "latest start": None if final is None else date.fromordinal(final)
+            }
+            for first, final in found
+        ]
+
+    @reads
+    def price_many(self, reservations : list[Reservation] | ReservationTable | None = None):
+        if reservations is None:
+            reservations = self.reservations
+        return self.price_table().price_many(reservations)
+
+    @reads
+    def revenue(self, start : date, end : date, location : str | None = None):
+        reservations = self.archived(start, end, location) + self.overlapping(start, end, location)
+        return self.price_table().revenue(reservations, start, end)
+
+    @writes
     def update_price(self, name : str, value : int):
         if value > 0:
-           self.price[name] = value
+            self.price[name] = value
+            self.prices = None
+            self.log("update_price", name=name, value=value)
     
+    @writes
     def update_quantity(self, name : str, value : int):
         if value > 0:
+            lowered = value < self.quantity[name]
             self.quantity[name] = value
-            if value < self.quantity[name]:
-                self.refresh()
-            
-    def save(self, filename : str):
-        data = {
-            "price" : self.price,
-            "quantity" : self.quantity,
-            "exclusions" : self.exclusions,
-            "resources" : self.resources,
-            "locations" : self.locations,
-            "requisites" : self.requisites,
-            "optionals" : self.optionals,
-            "reservations" : []
-        }
-        for reserve in self.reservations:
-            _reserve = {
-                "ID": reserve["ID"],
-                "start": reserve["start"].isoformat(),
-                "end": reserve["end"].isoformat(),
-                "location": reserve["location"],
-                "optionals": reserve["optionals"]
-            }
-            data["reservations"].append(_reserve)
-        return save_data(data, filename)
-
-    def load(self, filename : str):
-        data = load_data(filename)
-        if data:
-            self.price = data["price"]
-            self.quantity = data["quantity"]
-            self.exclusions = data["exclusions"]
-            self.resources = data["resources"]
-            self.locations = data["locations"]
-            self.requisites = data["requisites"]
-            self.optionals = data["optionals"]
-            self.reservations = []
-            for reserve in data["reservations"]:
-                _reserve = {                
-                    "ID": reserve["ID"],
-                    "start": date.fromisoformat(reserve["start"]),
-                    "end": date.fromisoformat(reserve["end"]),
-                    "location": reserve["location"],
-                    "optionals": reserve["optionals"]
+            cascade = self.refresh() if lowered else None
+            # The outcome is journaled rather than the refresh, which depends on
+            # the day it runs and on which reservations are loaded.
+            outcome = {}
+            if cascade:
+                outcome = {
+                    "moved": [
+                        {"ID": item["ID"], "start": item["start"].isoformat(), "end": item["end"].isoformat()}
+                        for item in cascade["shifted"]
+                    ],
+                    "rejected": [item["ID"] for item in cascade["rejected"]]
                 }
-                self.id_map[_reserve["ID"]] = _reserve
-                if (code_to_id(reserve["ID"]) > code_to_id(self.last_id)):
-                    self.last_id = reserve["ID"]
-                self.reservations.append(_reserve)
+            self.log("update_quantity", name=name, value=value, **outcome)
+            return cascade
+
+    def shift(self, moved : list[dict[str, str]], rejected : list[str]):
+        self.drop([self.id_map[code_to_id(code)] for code in rejected if code_to_id(code) in self.id_map])
+        for item in moved:
+            reservation = self.id_map.get(code_to_id(item["ID"]))
+            if reservation is None:
+                continue
+            self.unschedule(reservation)
+            reservation.start = date.fromisoformat(item["start"]).toordinal()
+            reservation.end = date.fromisoformat(item["end"]).toordinal()
+            self.schedule(reservation)
+        self.reservations.sort(key=attrgetter("start"))
+
+    @writes
+    def set_shift_policy(self, max_shift : int | None = None, horizon : int | None = None):
+        if (max_shift is not None and max_shift < 0) or (horizon is not None and horizon < 0):
+            return False, "The shift limit and horizon cannot be negative"
+        self.max_shift = max_shift
+        self.horizon = horizon
+        self.log("set_shift_policy", max_shift=max_shift, horizon=horizon)
+        return True, "Operation Succeded"
+
+    def log(self, op : str, **args):
+        self.version += 1
+        if self.journal:
+            self.journal.append(op, args)
+            self.checkpoint()
+
+    def checkpoint(self):
+        if self.journal.pending >= self.compact_every:
+            removed = set(self.removed)
+            tombstones = {kind: set(names) for kind, names in self.tombstones.items()}
+            self.journal.compact(self.state(), lambda data: self.write(data, self.snapshot, removed, tombstones))
+
+    def replay(self, entry : dict[str, Any]):
+        if entry["op"] == "add_reservation":
+            # A snapshot saved without its journal position can already hold the booking.
+            if not code_to_id(entry["args"]["reservation"]["ID"]) in self.id_map:
+                _reserve = self.restore(entry["args"]["reservation"])
+                self.schedule(_reserve)
+                self.insert(_reserve, self.reservations)
+        elif entry["op"] == "update_quantity" and "moved" in entry["args"]:
+            args = entry["args"]
+            self.quantity[args["name"]] = args["value"]
+            self.shift(args["moved"], args["rejected"])
+        else:
+            getattr(self, entry["op"])(**entry["args"])
+        self.journal_seq = entry["seq"]
+
+    @writes
+    def open_journal(self, filename : str):
+        self.close_journal()
+        self.snapshot = filename
+        self.journal = Journal(filename + ".journal", self.journal_seq)
+        return self.save(filename)
+
+    @writes
+    def close_journal(self):
+        if self.journal:
+            self.journal.close()
+            self.journal_seq = self.journal.seq
+            self.journal = None
+            self.snapshot = None
+
+    def encode(self, reservation : Reservation):
+        return {
+            "ID": id_to_code(reservation.id),
+            "start": date.fromordinal(reservation.start).isoformat(),
+            "end": date.fromordinal(reservation.end).isoformat(),
+            "location": self.location_ids.names[reservation.location],
+            "optionals": self.resource_ids.unmask(reservation.optionals)
+        }
+
+    def decode(self, reserve : dict[str, Any]):
+        return Reservation(
+            code_to_id(reserve["ID"]),
+            date.fromisoformat(reserve["start"]).toordinal(),
+            date.fromisoformat(reserve["end"]).toordinal(),
+            self.location_ids.index(reserve["location"]),
+            self.resource_ids.mask(reserve["optionals"])
+        )
+
+    def describe(self, reservation : Reservation):
+        return {
+            "ID": id_to_code(reservation.id),
+            "start": date.fromordinal(reservation.start),
+            "end": date.fromordinal(reservation.end),
+            "location": self.location_ids.names[reservation.location],
+            "optionals": self.resource_ids.unmask(reservation.optionals)
+        }
+
+    def restore(self, reserve : dict[str, Any]):
+        _reserve = self.decode(reserve)
+        self.id_map[_reserve.id] = _reserve
+        if _reserve.id > self.last_id:
+            self.last_id = _reserve.id
+        return _reserve
+
+    def restore_columns(self, columns : dict[str, Any]):
+        # Binary snapshots intern names in catalogue order, so the remapping
+        # below is usually the identity.
+        locations = np.array([self.location_ids.index(name) for name in columns["locations"]], dtype=np.int32)
+        locations = locations[columns["location_ids"]]
+        masks = remap_masks(columns["optionals"], columns["resources"], {name: self.resource_ids.index(name) for name in columns["resources"]})
+        ids, starts, ends = columns["ids"], columns["starts"], columns["ends"]
+        restored = []
+        for row in zip(ids.tolist(), starts.tolist(), ends.tolist(), locations.tolist(), masks.tolist()):
+            _reserve = Reservation(*row)
+            self.id_map[_reserve.id] = _reserve
+            restored.append(_reserve)
+        if restored:
+            self.last_id = max(self.last_id, int(ids.max()))
+        units = {}
+        for i, name in enumerate(self.location_ids.names):
+            for requisite in self.requisites.get(name, []):
+                units[requisite] = units.get(requisite, 0) + (locations == i)
+        for name, bit in self.resource_ids.ids.items():
+            used = ((masks >> bit) & 1).astype(np.int64)
+            if used.any():
+                units[name] = units.get(name, 0) + used
+        self.scheduler.add_columns(ids, starts, ends, locations, self.location_ids.names,
+                                   {name: np.asarray(count, dtype=np.int64) for name, count in units.items()})
+        return restored
+
+    @reads
+    def state(self):
+        return {
+            "price" : dict(self.price),
+            "quantity" : dict(self.quantity),
+            "exclusions" : {name: list(value) for name, value in self.exclusions.items()},
+            "resources" : list(self.resources),
+            "locations" : list(self.locations),
+            "requisites" : {name: list(value) for name, value in self.requisites.items()},
+            "optionals" : {name: list(value) for name, value in self.optionals.items()},
+            "max_shift" : self.max_shift,
+            "horizon" : self.horizon,
+            "journal_seq" : self.journal.seq if self.journal else self.journal_seq,
+            "reservations" : [self.encode(reserve) for reserve in self.reservations]
+        }
+
+    def archived(self, start : date | None = None, end : date | None = None, location : str | None = None, limit : int | None = None):
+        if not self.archive:
+            return []
+        found = []
+        for reserve in self.archive.search(start, end, location, before=self.cutoff, limit=limit):
+            _reserve = self.unarchive(reserve)
+            if _reserve:
+                found.append(_reserve)
+        return found
+
+    def unarchive(self, reserve : dict[str, Any] | None):
+        # Archived records are read under the read lock, so names are looked up
+        # rather than interned, and anything deleted since the load is left out.
+        if not reserve:
+            return None
+        id = code_to_id(reserve["ID"])
+        location = reserve["location"]
+        if id in self.removed or not location in self.requisites or location in self.tombstones["locations"]:
+            return None
+        mask = 0
+        for optional in reserve["optionals"]:
+            if optional in self.quantity and not optional in self.tombstones["resources"]:
+                mask |= 1 << self.resource_ids.ids[optional]
+        return Reservation(
+            id,
+            date.fromisoformat(reserve["start"]).toordinal(),
+            date.fromisoformat(reserve["end"]).toordinal(),
+            self.location_ids.ids[location],
+            mask
+        )
+
+    def overlapping(self, start : date | None = None, end : date | None = None, location : str | None = None):
+        first = start.toordinal() if start else date.min.toordinal()
+        last = end.toordinal() if end else date.max.toordinal()
+        found = []
+        for name in ([location] if location else self.locations):
+            # The index leaves out each end day, which still counts as a match.
+            for item in self.scheduler.booked(name, max(first - 1, 1), last):
+                if self.id_map[item[2]].end >= first:
+                    found.append(self.id_map[item[2]])
+        found.sort(key=attrgetter("start"))
+        return found
+
+    @reads
+    def cached(self, key : tuple, build):
+        with self.views_lock:
+            if self.views_version != self.version:
+                self.views = {}
+                self.views_version = self.version
+            if not key in self.views:
+                if len(self.views) >= self.views_limit:
+                    del self.views[next(iter(self.views))]
+                self.views[key] = build()
+            return self.views[key]
+
+    def matches(self, start : date | None = None, end : date | None = None, location : str | None = None):
+        def build():
+            archived = {reservation.id: reservation for reservation in self.archived(start, end, location)}
+            return list(archived) + [reservation.id for reservation in self.overlapping(start, end, location)], archived
+        return self.cached(("matches", start, end, location), build)
+
+    @reads
+    def count(self, start : date | None = None, end : date | None = None, location : str | None = None):
+        return len(self.matches(start, end, location)[0])
+
+    @reads
+    def search(self, start : date | None = None, end : date | None = None, location : str | None = None,
+               offset : int = 0, limit : int | None = None):
+        ids, archived = self.matches(start, end, location)
+        page = ids[offset:] if limit is None else ids[offset:offset + limit]
+        return [self.describe(archived[id] if id in archived else self.id_map[id]) for id in page]
+
+    @reads
+    def get(self, id : int | str):
+        if isinstance(id, str):
+            id = code_to_id(id)
+        if id in self.id_map:
+            return self.describe(self.id_map[id])
+        if self.archive:
+            _reserve = self.unarchive(self.archive.get(id_to_code(id)))
+            if _reserve:
+                return self.describe(_reserve)
+        return None
+
+    @timed
+    def write(self, data : dict[str, Any], filename : str, removed : set[int] | None = None,
+              tombstones : dict[str, set[str]] | None = None):
+        storage = open_storage(filename)
+        with self.saving:
+            if self.archive:
+                if self.archive.filename == filename:
+                    if tombstones is None:
+                        tombstones = {kind: set(names) for kind, names in self.tombstones.items()}
+                    # The archive's own store writes it, so it can let go of what it has open.
+                    if not self.archive.save(data, self.cutoff, self.removed if removed is None else removed, tombstones):
+                        return False
+                    # The archive no longer holds what the tombstones hid, so they
+                    # are dropped and the reports read the history again.
+                    for kind, names in tombstones.items():
+                        self.tombstones[kind] -= names
+                    with self.views_lock:
+                        if self.view is not None:
+                            self.view.forget()
+                    return True
+                data["reservations"] = [self.encode(reserve) for reserve in self.archived()] + data["reservations"]
+            return storage.save(data)
+
+    @reads
+    def save(self, filename : str):
+        data = self.state()
+        if self.journal and filename == self.snapshot:
+            self.journal.wait()
+            data["journal_seq"] = self.journal.seq
+            if not self.write(data, filename):
+                return False
+            self.journal.truncate(data["journal_seq"])
             return True
-        return False
+        return self.write(data, filename)
+
+    @timed
+    def read(self, storage, cutoff : int | None, columnar : bool, lazy : bool, progress = None):
+        self.archive = storage if cutoff and (storage.lazy or lazy) and not columnar else None
+        self.cutoff = cutoff if self.archive or columnar else None
+        seen = set()
+        pending = []
+        past = []
+        columns = None
+        restored = []
+        for key, value, fraction in storage.stream(cutoff):
+            if key == "reservations":
+                pending.extend(value)
+            elif key == "last_id":
+                self.last_id = max(self.last_id, code_to_id(value))
+            elif key == "journal_seq":
+                self.journal_seq = value
+            elif key in ("max_shift", "horizon"):
+                setattr(self, key, value)
+            elif key == "columns":
+                columns = value
+            elif key == "removed":
+                self.removed = set(value)
+            elif key in CATALOGUE:
+                setattr(self, key, value)
+                seen.add(key)
+                if key == "locations":
+                    self.location_ids = Interner(value)
+                elif key == "resources":
+                    self.resource_ids = Interner(value)
+            # Reservations can only be indexed once the requisites and names are known.
+            if len(seen) == len(CATALOGUE):
+                for reserve in pending:
+                    if self.cutoff and date.fromisoformat(reserve["end"]).toordinal() < self.cutoff:
+                        self.last_id = max(self.last_id, code_to_id(reserve["ID"]))
+                        if not self.archive:
+                            past.append(self.decode(reserve))
+                        continue
+                    _reserve = self.restore(reserve)
+                    self.reservations.append(_reserve)
+                    restored.append(_reserve)
+                pending = []
+                if columns is not None:
+                    self.reservations += self.restore_columns(columns)
+                    columns = None
+            if progress:
+                progress(fraction)
+        if len(seen) < len(CATALOGUE):
+            return False
+        self.schedule_many(restored)
+        self.index_exclusions()
+        for location in self.locations:
+            self.link(location)
+        if columnar and not self.archive:
+            if storage.lazy:
+                # Lazy stores do not stream what ended before the cutoff, so it is read here.
+                skip = {reservation.id for reservation in past} | self.removed
+                past += [
+                    self.decode(reserve) for reserve in storage.search(before=self.cutoff)
+                    if not code_to_id(reserve["ID"]) in skip and reserve["location"] in self.locations
+                ]
+            self.archive = ReservationTable(self.location_ids, self.resource_ids, past)
+        self.reservations.sort(key=attrgetter("start"))
+        return True
+
+    @writes
+    def load(self, filename : str, cutoff : date | None = None, columnar : bool = False, lazy : bool = False, progress = None):
+        storage = open_storage(filename)
+        if cutoff is None and (storage.lazy or columnar or lazy):
+            cutoff = datetime.now().date()
+        staged = Manager()
+        staged.metrics = self.metrics
+        try:
+            if not staged.read(storage, cutoff.toordinal() if cutoff else None, columnar, lazy, progress):
+                return False
+        except (ValueError, KeyError, TypeError):
+            return False
+        self.close_journal()
+        for name in STATE:
+            setattr(self, name, getattr(staged, name))
+        for entry in read_journal(filename + ".journal"):
+            if entry["seq"] > self.journal_seq:
+                self.replay(entry)
+        self.version += 1
+        return True
@@ -0,0 +1,127 @@
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+from bisect import bisect_left
+
+BOUNDS = (1e-5, 3e-5, 1e-4, 3e-4, 1e-3, 3e-3, 1e-2, 3e-2, 0.1, 0.3, 1.0, 3.0, 10.0)
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BOUNDS) + 1)
+
+    def add(self, seconds : float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect_left(BOUNDS, seconds)] += 1
+
+    def quantile(self, fraction : float):
+        # Upper bound of the bucket holding the quantile, capped by the slowest call.
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min(BOUNDS[i], self.max) if i < len(BOUNDS) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "calls": self.count,
+            "total_s": self.total,
+            "mean_ms": self.total / self.count * 1e3 if self.count else 0.0,
+            "p50_ms": self.quantile(0.5) * 1e3,
+            "p99_ms": self.quantile(0.99) * 1e3,
+            "max_ms": self.max * 1e3,
+            "buckets": {f"<={bound}": count for bound, count in zip(BOUNDS, self.buckets)} | {"slower": self.buckets[-1]}
+        }
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings : dict[str, Histogram] = {}
+        self.counters : dict[str, int] = {}
+        self.gauges : dict[str, dict] = {}
+        self.armed : set[str] = set()
+        self.profiles : dict[str, str] = {}
+        self.profiling = False
+        self.enabled = True
+
+    def observe(self, name : str, seconds : float):
+        with self.lock:
+            if not name in self.timings:
+                self.timings[name] = Histogram()
+            self.timings[name].add(seconds)
+
+    def count(self, name : str, value : int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name : str, value : dict):
+        with self.lock:
+            self.gauges[name] = value
+
+    def profile(self, name : str):
+        with self.lock:
+            self.armed.add(name)
+
+    def claim(self, name : str):
+        with self.lock:
+            # Only one profiler can be active at a time, so nested operations
+            # run unprofiled while another capture is in progress.
+            if name in self.armed and not self.profiling:
+                self.armed.discard(name)
+                self.profiling = True
+                return True
+            return False
+
+    def call(self, name : str, function, /, *args, **kwargs):
+        if not self.enabled:
+            return function(*args, **kwargs)
+        if self.armed and self.claim(name):
+            return self.capture(name, function, *args, **kwargs)
+        begin = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.observe(name, time.perf_counter() - begin)
+
+    def capture(self, name : str, function, /, *args, **kwargs):
+        profiler = cProfile.Profile()
+        begin = time.perf_counter()
+        try:
+            return profiler.runcall(function, *args, **kwargs)
+        finally:
+            self.observe(name, time.perf_counter() - begin)
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(30)
+            with self.lock:
+                self.profiles[name] = text.getvalue()
+                self.profiling = False
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "timings": {name: histogram.summary() for name, histogram in sorted(self.timings.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "gauges": dict(self.gauges),
+                "profiles": sorted(self.profiles)
+            }
+
+    def dump(self, filename : str):
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def reset(self):
+        with self.lock:
+            self.timings = {}
+            self.counters = {}
+            self.gauges = {}
+            self.profiles = {}
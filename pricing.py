@@ -0,0 +1,63 @@
+from datetime import date
+from operator import attrgetter
+import numpy as np
+import pandas as pd
+from reservation import Interner, Reservation, ReservationTable
+
+def columns(reservations : list[Reservation] | ReservationTable):
+    if isinstance(reservations, ReservationTable):
+        return reservations.starts, reservations.ends, reservations.location_ids, reservations.optionals
+    count = len(reservations)
+    starts = np.fromiter(map(attrgetter("start"), reservations), dtype=np.int64, count=count)
+    ends = np.fromiter(map(attrgetter("end"), reservations), dtype=np.int64, count=count)
+    locations = np.fromiter(map(attrgetter("location"), reservations), dtype=np.int64, count=count)
+    masks = [reservation.optionals for reservation in reservations]
+    if max(masks, default=0) < 1 << 64:
+        optionals = np.array(masks, dtype=np.uint64)
+    else:
+        optionals = np.array(masks, dtype=object)
+    return starts, ends, locations, optionals
+
+class PriceTable:
+    def __init__(self, price : dict[str, int], requisites : dict[str, list[str]], location_ids : Interner, resource_ids : Interner):
+        self.resources = np.array([price.get(name, 0) for name in resource_ids.names], dtype=np.int64)
+        self.locations = np.array([
+            price.get(name, 0) + sum(price.get(requisite, 0) for requisite in requisites.get(name, []))
+            for name in location_ids.names
+        ], dtype=np.int64)
+        # Optionals are bitmasks, so they are priced one byte at a time: bytes[k][b]
+        # is the summed price of the resources set in byte b of the k-th byte.
+        padded = np.zeros(-(-len(self.resources) // 8) * 8, dtype=np.int64)
+        padded[:len(self.resources)] = self.resources
+        bits = (np.arange(256)[:, None] >> np.arange(8)) & 1
+        self.bytes = bits @ padded.reshape(-1, 8).T
+
+    def daily(self, location : int, optionals : int):
+        total = int(self.locations[location])
+        index = 0
+        while optionals:
+            if optionals & 1:
+                total += int(self.resources[index])
+            optionals >>= 1
+            index += 1
+        return total
+
+    def daily_many(self, locations : np.ndarray, optionals : np.ndarray):
+        total = self.locations[locations]
+        for k in range(self.bytes.shape[1]):
+            total = total + self.bytes[((optionals >> (8 * k)) & 0xFF).astype(np.int64), k]
+        return total
+
+    def price_many(self, reservations : list[Reservation] | ReservationTable):
+        starts, ends, locations, optionals = columns(reservations)
+        return self.daily_many(locations, optionals) * (ends - starts + 1)
+
+    def revenue(self, reservations : list[Reservation] | ReservationTable, start : date, end : date):
+        first, last = start.toordinal(), end.toordinal()
+        starts, ends, locations, optionals = columns(reservations)
+        selected = (starts <= last) & (ends >= first)
+        daily = self.daily_many(locations[selected], optionals[selected])
+        days = np.zeros(last - first + 2, dtype=np.int64)
+        np.add.at(days, np.maximum(starts[selected], first) - first, daily)
+        np.add.at(days, np.minimum(ends[selected], last) - first + 1, -daily)
+        return pd.Series(np.cumsum(days[:-1]), index=pd.date_range(start, end, freq="D"), name="revenue")
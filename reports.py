@@ -0,0 +1,223 @@
+from datetime import date
+import numpy as np
+import pandas as pd
+from binary import remap_masks
+from pricing import columns
+from reservation import ReservationTable, code_to_id
+from storage import BinaryStorage
+
+class ReservationView:
+    # Columns of every reservation the manager can report on. History is read
+    # once per archive, live reservations are patched from the ids the manager
+    # marks as touched, so a mutation costs a few row writes instead of a rebuild.
+    def __init__(self):
+        self.archive = None
+        self.cutoff : int | None = None
+        self.past = None
+        self.slots : dict[int, int] = {}
+        self.size = 0
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.starts = np.zeros(0, dtype=np.int64)
+        self.ends = np.zeros(0, dtype=np.int64)
+        self.locations = np.zeros(0, dtype=np.int64)
+        self.optionals = np.zeros(0, dtype=np.uint64)
+        self.alive = np.zeros(0, dtype=bool)
+
+    def rebuild(self, manager):
+        reservations = manager.reservations
+        self.starts, self.ends, self.locations, self.optionals = columns(reservations)
+        if len(manager.resource_ids.names) > 64:
+            self.optionals = self.optionals.astype(object)
+        self.ids = np.fromiter((reservation.id for reservation in reservations), dtype=np.int64, count=len(reservations))
+        self.alive = np.ones(len(reservations), dtype=bool)
+        self.slots = {reservation.id: i for i, reservation in enumerate(reservations)}
+        self.size = len(reservations)
+
+    def grow(self):
+        capacity = max(2 * len(self.ids), 64)
+        for name in ("ids", "starts", "ends", "locations", "optionals", "alive"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def update(self, manager, touched : set[int]):
+        for id in touched:
+            reservation = manager.id_map.get(id)
+            slot = self.slots.get(id)
+            if reservation is None:
+                if slot is not None:
+                    self.alive[slot] = False
+                    del self.slots[id]
+                continue
+            if slot is None:
+                if self.size == len(self.ids):
+                    self.grow()
+                slot = self.slots[id] = self.size
+                self.size += 1
+            self.ids[slot] = reservation.id
+            self.starts[slot] = reservation.start
+            self.ends[slot] = reservation.end
+            self.locations[slot] = reservation.location
+            self.optionals[slot] = reservation.optionals
+            self.alive[slot] = True
+
+    def history(self, manager):
+        archive = manager.archive
+        if archive is None:
+            return None
+        if self.archive is archive and self.cutoff == manager.cutoff:
+            return self.past
+        if isinstance(archive, (ReservationTable, BinaryStorage)):
+            table = archive if isinstance(archive, ReservationTable) else archive.table()
+            ids, starts, ends = table.ids, table.starts, table.ends
+            lookup = np.array([manager.location_ids.ids.get(name, -1) for name in table.locations.names] + [-1], dtype=np.int64)
+            locations = lookup[table.location_ids]
+            known = {name: manager.resource_ids.ids[name] for name in table.resources.names if name in manager.resource_ids.ids}
+            optionals = remap_masks(table.optionals, table.resources.names, known)
+        else:
+            # Stores without columns hand out records, which are read once here
+            # without growing the manager's name tables under its read lock.
+            found = archive.search(before=manager.cutoff)
+            ids = np.array([code_to_id(reserve["ID"]) for reserve in found], dtype=np.int64)
+            starts = np.array([date.fromisoformat(reserve["start"]).toordinal() for reserve in found], dtype=np.int64)
+            ends = np.array([date.fromisoformat(reserve["end"]).toordinal() for reserve in found], dtype=np.int64)
+            locations = np.array([manager.location_ids.ids.get(reserve["location"], -1) for reserve in found], dtype=np.int64)
+            masks = []
+            for reserve in found:
+                mask = 0
+                for optional in reserve["optionals"]:
+                    if optional in manager.resource_ids.ids:
+                        mask |= 1 << manager.resource_ids.ids[optional]
+                masks.append(mask)
+            optionals = np.array(masks, dtype=np.uint64 if len(manager.resource_ids.names) <= 64 else object)
+        rows = (ends < manager.cutoff) & (locations >= 0)
+        self.past = (ids[rows], starts[rows], ends[rows], locations[rows], optionals[rows])
+        self.archive = archive
+        self.cutoff = manager.cutoff
+        return self.past
+
+    def forget(self):
+        # The archive was rewritten in place, so its history is read again.
+        self.archive = None
+
+    def sync(self, manager):
+        wide = len(manager.resource_ids.names) > 64
+        if manager.touched is None or wide != (self.optionals.dtype == object) or self.size > 2 * len(self.slots) + 1024:
+            self.rebuild(manager)
+        else:
+            self.update(manager, manager.touched)
+        manager.touched = set()
+        live = np.flatnonzero(self.alive[:self.size])
+        parts = [(self.ids[live], self.starts[live], self.ends[live], self.locations[live], self.optionals[live])]
+        past = self.history(manager)
+        if past is not None and len(past[0]):
+            # Archived rows stay out once deleted, or once their location is,
+            # even if a location of the same name was added again since.
+            current = set(manager.locations) - manager.tombstones["locations"]
+            valid = np.array([name in current for name in manager.location_ids.names] + [False])
+            rows = valid[past[3]]
+            if manager.removed:
+                rows &= ~np.isin(past[0], list(manager.removed))
+            past = tuple(column[rows] for column in past)
+            stripped = 0
+            for name in manager.tombstones["resources"]:
+                if name in manager.resource_ids.ids:
+                    stripped |= 1 << manager.resource_ids.ids[name]
+            if stripped:
+                ids, starts, ends, locations, optionals = past
+                keep = ~stripped if optionals.dtype == object else np.uint64(~stripped & (2 ** 64 - 1))
+                past = (ids, starts, ends, locations, optionals & keep)
+            parts.append(past)
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+def requirements(manager):
+    # required[l, r] is how many units of resource r location l always takes.
+    required = np.zeros((len(manager.location_ids.names), len(manager.resources)), dtype=np.int64)
+    index = {name: i for i, name in enumerate(manager.resources)}
+    for location, requisites in manager.requisites.items():
+        if location in manager.location_ids.ids:
+            for requisite in requisites:
+                if requisite in index:
+                    required[manager.location_ids.ids[location], index[requisite]] += 1
+    return required
+
+def spread(first : np.ndarray, last : np.ndarray, weights : np.ndarray, days : int):
+    # Adds each weight to every day from first to last, inclusive.
+    changes = np.bincount(first, weights=weights, minlength=days + 1) - np.bincount(last + 1, weights=weights, minlength=days + 1)
+    return np.rint(np.cumsum(changes[:days])).astype(np.int64)
+
+def summarize(manager, view : ReservationView, start : date, end : date, top : int = 10):
+    first, last = start.toordinal(), end.toordinal()
+    days = last - first + 1
+    _, starts, ends, locations, optionals = view.sync(manager)
+    rows = (starts <= last) & (ends >= first)
+    starts, ends, locations, optionals = starts[rows], ends[rows], locations[rows], optionals[rows]
+    # Day offsets of each reservation clipped to the window.
+    lows = np.maximum(starts, first) - first
+    highs = np.minimum(ends, last) - first
+    lengths = highs - lows + 1
+    dates = pd.date_range(start, end, freq="D")
+
+    daily = manager.price_table().daily_many(locations, optionals)
+    revenue = pd.Series(spread(lows, highs, daily, days), index=dates, name="revenue")
+    active = spread(lows, highs, np.ones(len(lows)), days)
+
+    count = len(manager.location_ids.names)
+    names = manager.location_ids.names
+    booked = np.bincount(locations, weights=lengths, minlength=count)
+    occupancy = pd.DataFrame({
+        "reservations": np.bincount(locations, minlength=count),
+        "booked days": booked.astype(np.int64),
+        "occupancy": booked / days,
+        "revenue": np.bincount(locations, weights=daily * lengths, minlength=count).astype(np.int64)
+    }, index=pd.Index(names, name="location")).loc[manager.locations]
+
+    required = requirements(manager)
+    heaviest = np.zeros(days)
+    busiest = np.full(days, -1, dtype=np.int64)
+    saturated = np.zeros(days, dtype=np.int64)
+    usage = []
+    loads = []
+    for r, name in enumerate(manager.resources):
+        units = required[locations, r] + ((optionals >> manager.resource_ids.ids[name]) & 1).astype(np.int64)
+        used = np.flatnonzero(units)
+        load = spread(lows[used], highs[used], units[used], days)
+        quantity = manager.quantity[name]
+        ratio = load / max(quantity, 1)
+        heavier = ratio > heaviest
+        heaviest[heavier] = ratio[heavier]
+        busiest[heavier] = r
+        saturated += load >= quantity
+        loads.append(load)
+        usage.append({
+            "resource": name,
+            "quantity": quantity,
+            "booked": int(load.sum()),
+            "capacity": quantity * days,
+            "utilization": load.sum() / max(quantity * days, 1),
+            "peak": int(load.max(initial=0)),
+            "full days": int((load >= quantity).sum())
+        })
+    utilization = pd.DataFrame(
+        usage, columns=["resource", "quantity", "booked", "capacity", "utilization", "peak", "full days"]
+    ).set_index("resource")
+
+    order = np.lexsort((-active, -heaviest))[:top]
+    order = order[heaviest[order] > 0]
+    contention = pd.DataFrame({
+        "day": [dates[i].date() for i in order],
+        "resource": [manager.resources[busiest[i]] for i in order],
+        "used": [int(loads[busiest[i]][i]) for i in order],
+        "quantity": [manager.quantity[manager.resources[busiest[i]]] for i in order],
+        "load": heaviest[order],
+        "resources full": saturated[order],
+        "reservations": active[order]
+    })
+    return {
+        "reservations": int(rows.sum()),
+        "revenue": revenue,
+        "utilization": utilization,
+        "occupancy": occupancy,
+        "contention": contention
+    }
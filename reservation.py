@@ -0,0 +1,127 @@
+from datetime import date
+import numpy as np
+
+def code_to_id(code: str) -> int:
+    return int(code.replace("RES-", ""))
+
+def id_to_code(num: int) -> str:
+    return f"RES-{num:03d}"
+
+class Interner:
+    def __init__(self, names : list[str] = ()):
+        self.names : list[str] = []
+        self.ids : dict[str, int] = {}
+        for name in names:
+            self.index(name)
+
+    def index(self, name : str):
+        if not name in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+    def mask(self, names : list[str]):
+        mask = 0
+        for name in names:
+            mask |= 1 << self.index(name)
+        return mask
+
+    def unmask(self, mask : int):
+        names = []
+        index = 0
+        while mask:
+            if mask & 1:
+                names.append(self.names[index])
+            mask >>= 1
+            index += 1
+        return names
+
+class Reservation:
+    __slots__ = ("id", "start", "end", "location", "optionals")
+
+    def __init__(self, id : int, start : int, end : int, location : int, optionals : int):
+        self.id = id
+        self.start = start
+        self.end = end
+        self.location = location
+        self.optionals = optionals
+
+    def __repr__(self):
+        return f"Reservation({id_to_code(self.id)}, {date.fromordinal(self.start)}, {date.fromordinal(self.end)})"
+
+class ReservationTable:
+    filename = None
+    lazy = False
+
+    def __init__(self, locations : Interner, resources : Interner, reservations : list[Reservation] = ()):
+        self.locations = locations
+        self.resources = resources
+        reservations = sorted(reservations, key=lambda reservation: reservation.id)
+        self.ids = np.array([reservation.id for reservation in reservations], dtype=np.int64)
+        self.starts = np.array([reservation.start for reservation in reservations], dtype=np.int32)
+        self.ends = np.array([reservation.end for reservation in reservations], dtype=np.int32)
+        self.location_ids = np.array([reservation.location for reservation in reservations], dtype=np.int32)
+        masks = [reservation.optionals for reservation in reservations]
+        if len(resources.names) <= 64:
+            self.optionals = np.array(masks, dtype=np.uint64)
+        else:
+            self.optionals = np.array(masks, dtype=object)
+
+    @classmethod
+    def columns(cls, locations : Interner, resources : Interner, ids : np.ndarray, starts : np.ndarray,
+                ends : np.ndarray, location_ids : np.ndarray, optionals : np.ndarray):
+        table = cls(locations, resources)
+        order = np.argsort(ids, kind="stable")
+        table.ids = ids[order]
+        table.starts = starts[order]
+        table.ends = ends[order]
+        table.location_ids = location_ids[order]
+        table.optionals = optionals[order]
+        return table
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, i : int):
+        return Reservation(
+            int(self.ids[i]),
+            int(self.starts[i]),
+            int(self.ends[i]),
+            int(self.location_ids[i]),
+            int(self.optionals[i])
+        )
+
+    def encode(self, i : int):
+        return {
+            "ID": id_to_code(int(self.ids[i])),
+            "start": date.fromordinal(int(self.starts[i])).isoformat(),
+            "end": date.fromordinal(int(self.ends[i])).isoformat(),
+            "location": self.locations.names[self.location_ids[i]],
+            "optionals": self.resources.unmask(int(self.optionals[i]))
+        }
+
+    def search(self, start : date | None = None, end : date | None = None, location : str | None = None,
+               before : int | None = None, limit : int | None = None):
+        selected = np.ones(len(self.ids), dtype=bool)
+        if location:
+            if not location in self.locations.ids:
+                return []
+            selected &= self.location_ids == self.locations.ids[location]
+        if end:
+            selected &= self.starts <= end.toordinal()
+        if start:
+            selected &= self.ends >= start.toordinal()
+        if before is not None:
+            selected &= self.ends < before
+        rows = np.flatnonzero(selected)
+        rows = rows[np.argsort(self.starts[rows], kind="stable")]
+        if limit is not None:
+            rows = rows[:limit]
+        return [self.encode(i) for i in rows]
+
+    def get(self, code : str):
+        id = code_to_id(code)
+        i = np.searchsorted(self.ids, id)
+        if i < len(self.ids) and self.ids[i] == id:
+            return self.encode(i)
+        return None
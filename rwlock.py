@@ -0,0 +1,53 @@
+import threading
+from contextlib import contextmanager
+
+class ReadWriteLock:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers : dict[int, int] = {}
+        self.writer : int | None = None
+        self.depth = 0
+        self.waiting = 0
+
+    @contextmanager
+    def read(self):
+        me = threading.get_ident()
+        with self.condition:
+            if self.writer != me:
+                # Waiting writers go first, except over a thread that already
+                # reads, which would otherwise wait on itself.
+                while self.writer is not None or (self.waiting and not me in self.readers):
+                    self.condition.wait()
+            self.readers[me] = self.readers.get(me, 0) + 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers[me] -= 1
+                if not self.readers[me]:
+                    del self.readers[me]
+                    self.condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self.condition:
+            if self.writer == me:
+                self.depth += 1
+            else:
+                if me in self.readers:
+                    raise RuntimeError("Cannot upgrade a read lock to a write lock")
+                self.waiting += 1
+                while self.writer is not None or self.readers:
+                    self.condition.wait()
+                self.waiting -= 1
+                self.writer = me
+                self.depth = 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.depth -= 1
+                if not self.depth:
+                    self.writer = None
+                    self.condition.notify_all()
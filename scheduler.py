@@ -0,0 +1,315 @@
+from bisect import bisect_left, bisect_right, insort
+import numpy as np
+
+class IntervalIndex:
+    def __init__(self):
+        self.items : list[tuple[int, int, str, int]] = []
+        self.longest = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, start : int, end : int, key : str, units : int = 1):
+        insort(self.items, (start, end, key, units))
+        if end - start > self.longest:
+            self.longest = end - start
+
+    def add_many(self, items : list[tuple[int, int, str, int]]):
+        self.items += items
+        self.items.sort()
+        for start, end, _, _ in items:
+            if end - start > self.longest:
+                self.longest = end - start
+
+    def remove(self, start : int, end : int, key : str):
+        i = bisect_left(self.items, (start, end, key))
+        if i < len(self.items) and self.items[i][2] == key:
+            del self.items[i]
+
+    def remove_many(self, items : list[tuple[int, int, str]]):
+        if len(items) * 32 < len(self.items):
+            for start, end, key in items:
+                self.remove(start, end, key)
+        else:
+            keys = {key for _, _, key in items}
+            self.items = [item for item in self.items if not item[2] in keys]
+
+    def overlapping(self, start : int, end : int):
+        # Nothing starting before start - longest can reach start, so only that
+        # slice of the sorted list has to be checked.
+        left = bisect_left(self.items, (start - self.longest,))
+        right = bisect_right(self.items, (end + 1,))
+        return [item for item in self.items[left:right] if item[1] >= start]
+
+class Timeline:
+    def __init__(self):
+        self.origin = 0
+        self.days = np.zeros(0, dtype=np.int64)
+
+    def grow(self, start : int, end : int):
+        if len(self.days) == 0:
+            self.origin = start
+            self.days = np.zeros(end - start + 1, dtype=np.int64)
+            return
+        if start < self.origin:
+            pad = max(self.origin - start, len(self.days))
+            self.days = np.concatenate((np.zeros(pad, dtype=np.int64), self.days))
+            self.origin -= pad
+        if end >= self.origin + len(self.days):
+            pad = max(end - self.origin - len(self.days) + 1, len(self.days))
+            self.days = np.concatenate((self.days, np.zeros(pad, dtype=np.int64)))
+
+    def add(self, start : int, end : int, units : int):
+        self.grow(start, end)
+        self.days[start - self.origin:end - self.origin + 1] += units
+
+    def add_many(self, starts : np.ndarray, ends : np.ndarray, units : np.ndarray):
+        if len(starts) == 0:
+            return
+        self.grow(int(starts.min()), int(ends.max()))
+        changes = np.zeros(len(self.days) + 1, dtype=np.int64)
+        np.add.at(changes, starts - self.origin, units)
+        np.add.at(changes, ends - self.origin + 1, -units)
+        self.days += np.cumsum(changes[:-1])
+
+    def window(self, start : int, end : int):
+        first = max(start - self.origin, 0)
+        last = max(min(end - self.origin + 1, len(self.days)), first)
+        return first, self.days[first:last]
+
+    def peak(self, start : int, end : int):
+        _, days = self.window(start, end)
+        if len(days) == 0:
+            return 0
+        return int(days.max())
+
+    def first_above(self, start : int, end : int, limit : int):
+        first, days = self.window(start, end)
+        above = np.flatnonzero(days > limit)
+        if len(above) == 0:
+            return None
+        return self.origin + first + int(above[0])
+
+def occupied(start : int, end : int):
+    # A reservation leaves its end day free for the next one, as the original
+    # refresh did, so it holds the days from start to end - 1. One starting
+    # and ending on the same day still holds that day.
+    return max(end - 1, start)
+
+class Scheduler:
+    # Reservations come in as (start, end) and are kept as the inclusive range
+    # of days they occupy. peak() and booked() take plain ranges of days.
+    def __init__(self):
+        self.locations : dict[str, IntervalIndex] = {}
+        self.resources : dict[str, IntervalIndex] = {}
+        self.timelines : dict[str, Timeline] = {}
+        self.checks = 0
+
+    def add(self, key : str, start : int, end : int, location : str, usage : dict[str, int]):
+        end = occupied(start, end)
+        if location not in self.locations:
+            self.locations[location] = IntervalIndex()
+        self.locations[location].add(start, end, key)
+        for resource, units in usage.items():
+            if resource not in self.resources:
+                self.resources[resource] = IntervalIndex()
+                self.timelines[resource] = Timeline()
+            self.resources[resource].add(start, end, key, units)
+            self.timelines[resource].add(start, end, units)
+
+    def add_many(self, entries : list[tuple[str, int, int, str, dict[str, int]]]):
+        locations : dict[str, list] = {}
+        resources : dict[str, list] = {}
+        for key, start, end, location, usage in entries:
+            end = occupied(start, end)
+            locations.setdefault(location, []).append((start, end, key, 1))
+            for resource, units in usage.items():
+                resources.setdefault(resource, []).append((start, end, key, units))
+        for location, items in locations.items():
+            if location not in self.locations:
+                self.locations[location] = IntervalIndex()
+            self.locations[location].add_many(items)
+        for resource, items in resources.items():
+            if resource not in self.resources:
+                self.resources[resource] = IntervalIndex()
+                self.timelines[resource] = Timeline()
+            self.resources[resource].add_many(items)
+            starts, ends, _, units = zip(*items)
+            self.timelines[resource].add_many(np.array(starts), np.array(ends), np.array(units))
+
+    def add_columns(self, keys : np.ndarray, starts : np.ndarray, ends : np.ndarray, locations : np.ndarray,
+                    names : list[str], units : dict[str, np.ndarray]):
+        # The same as add_many over rows given as arrays, with `units` holding
+        # how much of each resource every row uses. Rows are put in item order
+        # first, which leaves the list sorts below next to nothing to do.
+        ends = np.maximum(ends - 1, starts)
+        order = np.lexsort((keys, ends, starts))
+        keys, starts, ends, locations = keys[order], starts[order], ends[order], locations[order]
+        for i, name in enumerate(names):
+            rows = np.flatnonzero(locations == i)
+            if len(rows) == 0:
+                continue
+            if name not in self.locations:
+                self.locations[name] = IntervalIndex()
+            self.locations[name].add_many(list(zip(starts[rows].tolist(), ends[rows].tolist(), keys[rows].tolist(), [1] * len(rows))))
+        for resource, counts in units.items():
+            counts = counts[order]
+            rows = np.flatnonzero(counts)
+            if len(rows) == 0:
+                continue
+            if resource not in self.resources:
+                self.resources[resource] = IntervalIndex()
+                self.timelines[resource] = Timeline()
+            self.resources[resource].add_many(list(zip(starts[rows].tolist(), ends[rows].tolist(), keys[rows].tolist(), counts[rows].tolist())))
+            self.timelines[resource].add_many(starts[rows], ends[rows], counts[rows])
+
+    def remove(self, key : str, start : int, end : int, location : str, usage : dict[str, int]):
+        end = occupied(start, end)
+        if location in self.locations:
+            self.locations[location].remove(start, end, key)
+        for resource, units in usage.items():
+            if resource in self.resources:
+                self.resources[resource].remove(start, end, key)
+                self.timelines[resource].add(start, end, -units)
+
+    def remove_many(self, entries : list[tuple[str, int, int, str, dict[str, int]]]):
+        locations : dict[str, list] = {}
+        resources : dict[str, list] = {}
+        for key, start, end, location, usage in entries:
+            end = occupied(start, end)
+            locations.setdefault(location, []).append((start, end, key))
+            for resource, units in usage.items():
+                resources.setdefault(resource, []).append((start, end, key))
+                if resource in self.timelines:
+                    self.timelines[resource].add(start, end, -units)
+        for location, items in locations.items():
+            if location in self.locations:
+                self.locations[location].remove_many(items)
+        for resource, items in resources.items():
+            if resource in self.resources:
+                self.resources[resource].remove_many(items)
+
+    def drop_location(self, name : str):
+        self.locations.pop(name, None)
+
+    def drop_resource(self, name : str):
+        self.resources.pop(name, None)
+        self.timelines.pop(name, None)
+
+    def location_keys(self, name : str):
+        if name not in self.locations:
+            return []
+        return [item[2] for item in self.locations[name].items]
+
+    def resource_keys(self, name : str):
+        if name not in self.resources:
+            return []
+        return [item[2] for item in self.resources[name].items]
+
+    def booked(self, location : str, start : int, end : int):
+        if location not in self.locations:
+            return []
+        return self.locations[location].overlapping(start, end)
+
+    def peak(self, resource : str, start : int, end : int):
+        if resource not in self.timelines:
+            return 0
+        return self.timelines[resource].peak(start, end)
+
+    def exceeded(self, resource : str, start : int, end : int, limit : int):
+        day = self.timelines[resource].first_above(start, end, max(limit, 0))
+        if day is None:
+            return None
+        return min(item[1] for item in self.resources[resource].overlapping(day, day)) + 1
+
+    def collision(self, start : int, end : int, location : str, usage : dict[str, int], quantity : dict[str, int]):
+        # The earliest start past what collides, which is the end date of the
+        # reservation in the way.
+        self.checks += 1
+        end = occupied(start, end)
+        shift = None
+        if location in self.locations:
+            for item in self.locations[location].overlapping(start, end):
+                if shift is None or item[1] + 1 > shift:
+                    shift = item[1] + 1
+        for resource, units in usage.items():
+            if resource in self.resources:
+                day = self.exceeded(resource, start, end, quantity[resource] - units)
+                if day is not None and (shift is None or day > shift):
+                    shift = day
+        return shift
+
+    def busy(self, start : int, end : int, location : str, usage : dict[str, int], quantity : dict[str, int]):
+        days = np.zeros(end - start + 1, dtype=bool)
+        if location in self.locations:
+            for item in self.locations[location].overlapping(start, end):
+                days[max(item[0] - start, 0):item[1] - start + 1] = True
+        for resource, units in usage.items():
+            if resource in self.timelines:
+                timeline = self.timelines[resource]
+                first, window = timeline.window(start, end)
+                offset = timeline.origin + first - start
+                days[offset:offset + len(window)] |= window > max(quantity[resource] - units, 0)
+        return days
+
+    def last_day(self, location : str, usage : dict[str, int]):
+        last = None
+        if location in self.locations and self.locations[location].items:
+            index = self.locations[location]
+            last = index.items[-1][0] + index.longest
+        for resource in usage:
+            if resource in self.timelines and len(self.timelines[resource].days):
+                timeline = self.timelines[resource]
+                last = max(last or timeline.origin, timeline.origin + len(timeline.days) - 1)
+        return last
+
+    def windows(self, start : int, length : int, location : str, usage : dict[str, int], quantity : dict[str, int],
+                n : int, latest : int | None = None):
+        # Sweeps the day by day occupancy in growing spans instead of trying
+        # placements. Each result is a run of feasible starts as (first, last),
+        # with last None when the run never ends. A booking of `length` days
+        # past its start leaves the last of them free.
+        length = max(length - 1, 0)
+        last = self.last_day(location, usage)
+        stop = start if last is None else max(last + 1, start)
+        if latest is not None:
+            if start > latest:
+                return []
+            stop = min(stop, latest)
+        found = []
+        span = 64 * (length + 1)
+        while len(found) < n:
+            end = min(start + span, stop)
+            counts = np.concatenate(([0], np.cumsum(self.busy(start, end + length, location, usage, quantity))))
+            fits = counts[length + 1:] == counts[:-length - 1]
+            edges = np.flatnonzero(np.diff(np.concatenate(([False], fits, [False])).astype(np.int8)))
+            runs = list(zip(edges[0::2].tolist(), (edges[1::2] - 1).tolist()))
+            resume = None
+            if runs and runs[-1][1] == end - start:
+                if end < stop:
+                    # The last run may go on past this span, so it is measured again by the next one.
+                    resume = start + runs.pop()[0]
+                else:
+                    first, _ = runs.pop()
+                    runs.append((first, None if latest is None else latest - start))
+            for first, final in runs[:n - len(found)]:
+                found.append((start + first, None if final is None else start + final))
+            if end == stop:
+                break
+            start = resume if resume is not None else end + 1
+            span *= 2
+        return found
+
+    def place(self, start : int, end : int, location : str, usage : dict[str, int], quantity : dict[str, int], latest : int | None = None):
+        # Every collision moves the start strictly forward, so with `latest` set
+        # a booking costs at most latest - start + 1 checks before it gives up.
+        if latest is not None and start > latest:
+            return None
+        length = end - start
+        shift = self.collision(start, end, location, usage, quantity)
+        while shift is not None:
+            if latest is not None and shift > latest:
+                return None
+            start = shift
+            shift = self.collision(start, start + length, location, usage, quantity)
+        return start, start + length
@@ -0,0 +1,185 @@
+import argparse
+import asyncio
+import json
+from datetime import date
+from urllib.parse import parse_qs, urlsplit
+from manager import Manager
+
+REASONS = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error"
+}
+
+def jsonable(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def parse_reservation(body : dict):
+    return (
+        date.fromisoformat(body["start"]),
+        date.fromisoformat(body["end"]),
+        body["location"],
+        list(body.get("optionals", []))
+    )
+
+class Service:
+    def __init__(self, manager : Manager, batch : int = 256):
+        self.manager = manager
+        self.batch = batch
+        self.queue : asyncio.Queue | None = None
+        self.batcher : asyncio.Task | None = None
+
+    async def start(self, host : str, port : int):
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.create_task(self.schedule())
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def schedule(self):
+        # Bookings that arrive while a pass is running wait in the queue and are
+        # placed together by the next one, in arrival order.
+        while True:
+            pending = [await self.queue.get()]
+            while len(pending) < self.batch and not self.queue.empty():
+                pending.append(self.queue.get_nowait())
+            try:
+                results = await asyncio.to_thread(self.manager.add_reservations_bulk, [body for body, _ in pending])
+            except Exception as error:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            for (_, future), result in zip(pending, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def book(self, body : dict):
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((body, future))
+        result = await future
+        return (201 if result["succeeded"] else 400), result
+
+    async def route(self, method : str, path : str, query : dict[str, list[str]], body):
+        parts = [part for part in path.split("/") if part]
+        if parts == ["reservations"]:
+            if method == "POST":
+                if not isinstance(body, dict):
+                    return 400, {"message": "Expected a JSON object"}
+                return await self.book(body)
+            if method == "GET":
+                start = date.fromisoformat(query["start"][0]) if "start" in query else None
+                end = date.fromisoformat(query["end"][0]) if "end" in query else None
+                location = query["location"][0] if "location" in query else None
+                offset = int(query.get("offset", ["0"])[0])
+                limit = int(query.get("limit", ["100"])[0])
+                count = await asyncio.to_thread(self.manager.count, start, end, location)
+                found = await asyncio.to_thread(self.manager.search, start, end, location, offset, limit)
+                return 200, {"count": count, "reservations": found}
+            return 405, {"message": f"{method} not allowed on /reservations"}
+        if len(parts) == 2 and parts[0] == "reservations":
+            found = await asyncio.to_thread(self.manager.get, parts[1])
+            if not found:
+                return 404, {"message": f"Reservation {parts[1]} not found"}
+            if method == "GET":
+                return 200, found
+            if method == "DELETE":
+                await asyncio.to_thread(self.manager.delete_reservation, parts[1])
+                return 200, {"deleted": found["ID"]}
+            return 405, {"message": f"{method} not allowed on /reservations/{parts[1]}"}
+        if parts == ["metrics"]:
+            if method != "GET":
+                return 405, {"message": f"{method} not allowed on /metrics"}
+            return 200, self.manager.metrics.snapshot()
+        if parts == ["quote"]:
+            if method != "POST":
+                return 405, {"message": f"{method} not allowed on /quote"}
+            succeeded, value = await asyncio.to_thread(self.manager.quote, *parse_reservation(body))
+            if not succeeded:
+                return 400, {"message": value}
+            return 200, {"price": value}
+        return 404, {"message": f"No endpoint at {path}"}
+
+    async def read_request(self, reader : asyncio.StreamReader):
+        line = await reader.readline()
+        if not line:
+            return None
+        method, target, version = line.decode("latin-1").split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        body = await reader.readexactly(length) if length else b""
+        connection = headers.get("connection", "").lower()
+        keep = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+        return method, target, body, keep
+
+    async def handle(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                method, target, body, keep = request
+                url = urlsplit(target)
+                try:
+                    status, payload = await self.route(method, url.path, parse_qs(url.query), json.loads(body) if body else None)
+                except (ValueError, KeyError, TypeError) as error:
+                    status, payload = 400, {"message": f"Malformed request: {error}"}
+                except Exception as error:
+                    status, payload = 500, {"message": str(error)}
+                content = json.dumps(payload, default=jsonable, ensure_ascii=False).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(content)}\r\n"
+                    f"Connection: {"keep-alive" if keep else "close"}\r\n\r\n".encode("latin-1") + content
+                )
+                await writer.drain()
+                if not keep:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(manager : Manager, host : str, port : int, batch : int):
+    service = Service(manager, batch)
+    server = await service.start(host, port)
+    print(f"Serving on http://{host}:{port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the reservation manager over HTTP/JSON")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--file", default="save.json", help="save file to load on start")
+    parser.add_argument("--journal", action="store_true", help="journal every change to the save file")
+    parser.add_argument("--batch", type=int, default=256, help="most bookings placed in one scheduling pass")
+    parser.add_argument("--metrics", default=None, help="write a metrics dump to this file on shutdown")
+    args = parser.parse_args()
+
+    manager = Manager()
+    if not manager.load(args.file):
+        print(f"Could not load {args.file}, starting empty")
+    if args.journal:
+        manager.open_journal(args.file)
+    try:
+        asyncio.run(serve(manager, args.host, args.port, args.batch))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        manager.close_journal()
+        if args.metrics:
+            manager.metrics.dump(args.metrics)
+
+if __name__ == "__main__":
+    main()
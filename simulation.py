@@ -0,0 +1,140 @@
+import argparse
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from loader import load_lines
+from manager import Manager
+from storage import MemoryStorage
+
+BASELINE = "baseline"
+
+# Each worker process rebuilds managers from one plain snapshot instead of
+# receiving a Manager, whose locks and journal cannot be pickled.
+snapshot_state : dict | None = None
+
+def snapshot(manager : Manager, since : date | None = None):
+    since = (since or datetime.now().date()).isoformat()
+    state = manager.state()
+    state["reservations"] = [reserve for reserve in state["reservations"] if reserve["end"] >= since]
+    return state
+
+def build(state : dict):
+    manager = Manager()
+    manager.metrics.enabled = False
+    manager.read(MemoryStorage(state), None, False, False)
+    return manager
+
+def simulate(state : dict, name : str, ops : list[tuple[str, dict]], demand : list[dict] | None = None):
+    begin = time.perf_counter()
+    manager = build(state)
+    starts = {reservation.id: reservation.start for reservation in manager.reservations}
+    for op, args in ops:
+        getattr(manager, op)(**args)
+    shifted = days = rejected = booked = 0
+    for id, start in starts.items():
+        if not id in manager.id_map:
+            rejected += 1
+        elif manager.id_map[id].start != start:
+            shifted += 1
+            days += manager.id_map[id].start - start
+    if demand:
+        for result, record in zip(manager.add_reservations_bulk(demand), demand):
+            if not result["succeeded"]:
+                rejected += 1
+                continue
+            booked += 1
+            moved = (result["start"] - date.fromisoformat(str(record["start"]))).days
+            if moved:
+                shifted += 1
+                days += moved
+    return {
+        "scenario": name,
+        "reservations": len(manager.reservations),
+        "booked": booked,
+        "shifted": shifted,
+        "shifted_days": days,
+        "rejected": rejected,
+        "revenue": int(manager.price_many().sum()) if manager.reservations else 0,
+        "seconds": time.perf_counter() - begin
+    }
+
+def prepare(state : dict):
+    global snapshot_state
+    snapshot_state = state
+
+def run(name : str, ops : list[tuple[str, dict]], demand : list[dict] | None):
+    return simulate(snapshot_state, name, ops, demand)
+
+def what_if(manager : Manager, scenarios : dict[str, list[tuple[str, dict]]], demand : list[dict] | None = None,
+            workers : int | None = None, since : date | None = None):
+    state = snapshot(manager, since)
+    scenarios = {BASELINE: []} | scenarios
+    # forkserver avoids forking a process that may hold other threads' locks.
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=prepare, initargs=(state,)) as pool:
+        futures = [pool.submit(run, name, ops, demand) for name, ops in scenarios.items()]
+        results = [future.result() for future in futures]
+    baseline = results[0]
+    for result in results:
+        result["revenue_delta"] = result["revenue"] - baseline["revenue"]
+        result["shifted_delta"] = result["shifted"] - baseline["shifted"]
+        result["rejected_delta"] = result["rejected"] - baseline["rejected"]
+    return results
+
+def quantity_sweep(resource : str, values):
+    return {f"{resource} quantity {value}": [("update_quantity", {"name": resource, "value": value})] for value in values}
+
+def price_sweep(name : str, values):
+    return {f"{name} price {value}": [("update_price", {"name": name, "value": value})] for value in values}
+
+def location_copy(manager : Manager, location : str, name : str):
+    return {f"add {name}": [("add_location", {
+        "name": name,
+        "price": manager.price[location],
+        "requisites": list(manager.requisites[location]),
+        "optionals": list(manager.optionals[location])
+    })]}
+
+def span(text : str):
+    first, _, last = text.partition(":")
+    return range(int(first), int(last or first) + 1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare catalogue changes before making them")
+    parser.add_argument("--file", default="save.json", help="save file to simulate from")
+    parser.add_argument("--quantity", action="append", default=[], help="RESOURCE=FIRST:LAST quantities to try")
+    parser.add_argument("--price", action="append", default=[], help="NAME=FIRST:LAST prices to try")
+    parser.add_argument("--copy", action="append", default=[], help="LOCATION=NEW_NAME location to duplicate")
+    parser.add_argument("--demand", default=None, help="JSON lines of bookings to place in every scenario")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    manager = Manager()
+    if not manager.load(args.file):
+        parser.error(f"could not load {args.file}")
+    scenarios = {}
+    for item in args.quantity:
+        name, _, values = item.partition("=")
+        scenarios |= quantity_sweep(name, span(values))
+    for item in args.price:
+        name, _, values = item.partition("=")
+        scenarios |= price_sweep(name, span(values))
+    for item in args.copy:
+        location, _, name = item.partition("=")
+        scenarios |= location_copy(manager, location, name)
+    demand = list(load_lines(args.demand)) if args.demand else None
+
+    begin = time.perf_counter()
+    results = what_if(manager, scenarios, demand, args.workers)
+    for result in results:
+        print(
+            f"{result['scenario']:<32} shifted {result['shifted']:>7} ({result['shifted_delta']:+d}) "
+            f"rejected {result['rejected']:>7} ({result['rejected_delta']:+d}) "
+            f"revenue {result['revenue']:>12} ({result['revenue_delta']:+d})"
+        )
+    print(f"{len(results)} scenarios in {time.perf_counter() - begin:.2f}s")
+
+if __name__ == "__main__":
+    main()
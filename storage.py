@@ -0,0 +1,474 @@
+import copy
+import json
+import os
+import sqlite3
+from contextlib import closing
+from datetime import date
+import numpy as np
+from binary import BINARY_EXTENSIONS, Snapshot, columns, encode_masks, metadata, remap_masks, save_binary, write_columns
+from loader import load_data, save_data, stream_data
+from reservation import Interner, ReservationTable, code_to_id, id_to_code
+
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+PARTITION_CACHE = 24
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reservations (
+    id INTEGER PRIMARY KEY,
+    code TEXT NOT NULL,
+    start_day INTEGER NOT NULL,
+    end_day INTEGER NOT NULL,
+    location TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reservations_location ON reservations (location, start_day, end_day);
+CREATE INDEX IF NOT EXISTS reservations_end ON reservations (end_day);
+CREATE TABLE IF NOT EXISTS reservation_resources (
+    reservation INTEGER NOT NULL REFERENCES reservations (id) ON DELETE CASCADE,
+    resource TEXT NOT NULL,
+    optional INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reservation_resources_resource ON reservation_resources (resource, reservation);
+CREATE INDEX IF NOT EXISTS reservation_resources_reservation ON reservation_resources (reservation);
+"""
+
+def open_storage(filename : str):
+    if filename.lower().endswith(SQLITE_EXTENSIONS):
+        return SqliteStorage(filename)
+    if filename.lower().endswith(BINARY_EXTENSIONS):
+        return BinaryStorage(filename)
+    return JsonStorage(filename)
+
+class MemoryStorage:
+    lazy = False
+    filename = None
+
+    def __init__(self, data : dict):
+        self.data = data
+
+    def stream(self, cutoff : int | None = None):
+        # The reader keeps what it is given, so the catalogue is copied to leave
+        # the data reusable. Reservation records are only read.
+        for key, value in self.data.items():
+            yield key, value if key == "reservations" else copy.deepcopy(value), 1.0
+
+class JsonStorage:
+    # Reservations that ended before the last save's cutoff live in monthly
+    # files next to the main one, keyed by the month they end in, so loading
+    # and saving only touch the main file and the months that change.
+    def __init__(self, filename : str):
+        self.filename = filename
+        self.folder = filename + ".archive"
+        self.loaded : dict[str, tuple[tuple[int, int], list]] = {}
+
+    @property
+    def lazy(self):
+        return os.path.exists(os.path.join(self.folder, "index.json"))
+
+    def index(self):
+        return load_data(os.path.join(self.folder, "index.json")) or {"before": None, "partitions": {}, "removed": []}
+
+    def partition(self, month : str):
+        path = os.path.join(self.folder, f"{month}.json")
+        if not os.path.exists(path):
+            return []
+        info = os.stat(path)
+        stamp = (info.st_mtime_ns, info.st_size)
+        if month in self.loaded and self.loaded[month][0] == stamp:
+            return self.loaded[month][1]
+        reservations = load_data(path) or []
+        if len(self.loaded) >= PARTITION_CACHE:
+            del self.loaded[next(iter(self.loaded))]
+        self.loaded[month] = (stamp, reservations)
+        return reservations
+
+    def stream(self, cutoff : int | None = None):
+        if not os.path.exists(self.filename):
+            return
+        yield from stream_data(self.filename)
+        if not self.lazy:
+            return
+        index = self.index()
+        yield "removed", index["removed"], 1.0
+        # Partitions only hold reservations that ended before `before`, so they
+        # are read only when the caller wants history from before that.
+        if cutoff is not None and index["before"] is not None and cutoff >= index["before"]:
+            return
+        first = date.fromordinal(cutoff).isoformat() if cutoff is not None else ""
+        removed = set(index["removed"])
+        for month in sorted(index["partitions"]):
+            if month < first[:7]:
+                continue
+            found = [reserve for reserve in self.partition(month) if reserve["end"] >= first and not code_to_id(reserve["ID"]) in removed]
+            if found:
+                yield "reservations", found, 1.0
+
+    def reservations(self, first : str = "", last : str = "9999-12", ids : int | None = None):
+        if os.path.exists(self.filename):
+            for key, value, _ in stream_data(self.filename):
+                if key == "reservations":
+                    yield from value
+        if not self.lazy:
+            return
+        for month, (low, high, _) in sorted(self.index()["partitions"].items()):
+            if first[:7] <= month <= last and (ids is None or low <= ids <= high):
+                yield from self.partition(month)
+
+    def search(self, start : date | None = None, end : date | None = None, location : str | None = None,
+               before : int | None = None, limit : int | None = None):
+        found = []
+        seen = set()
+        last = date.fromordinal(before - 1).isoformat()[:7] if before is not None else "9999-12"
+        for reserve in self.reservations(start.isoformat() if start else "", last):
+            first = date.fromisoformat(reserve["start"]).toordinal()
+            final = date.fromisoformat(reserve["end"]).toordinal()
+            if location and reserve["location"] != location:
+                continue
+            if (end and first > end.toordinal()) or (start and final < start.toordinal()):
+                continue
+            if before is not None and final >= before:
+                continue
+            # A save interrupted after writing a partition can leave a copy in the main file too.
+            if reserve["ID"] in seen:
+                continue
+            seen.add(reserve["ID"])
+            found.append((first, reserve))
+        found.sort(key=lambda item: item[0])
+        return [reserve for _, reserve in found[:limit]]
+
+    def get(self, code : str):
+        for reserve in self.reservations(ids=code_to_id(code)):
+            if reserve["ID"] == code:
+                return reserve
+        return None
+
+    def archive(self, index : dict, added : dict[str, list], months : set[str], keep, removed : set[int], fresh : bool = False):
+        purged = set()
+        for month in sorted(months | set(added)):
+            merged = {} if fresh else {reserve["ID"]: reserve for reserve in self.partition(month)}
+            for reserve in added.get(month, []):
+                merged[reserve["ID"]] = reserve
+            rows = []
+            for reserve in merged.values():
+                id = code_to_id(reserve["ID"])
+                if id in removed:
+                    purged.add(id)
+                elif keep(reserve):
+                    rows.append(reserve)
+            path = os.path.join(self.folder, f"{month}.json")
+            if rows:
+                rows.sort(key=lambda reserve: (reserve["start"], code_to_id(reserve["ID"])))
+                os.makedirs(self.folder, exist_ok=True)
+                if not save_data(rows, path):
+                    return False
+                ids = [code_to_id(reserve["ID"]) for reserve in rows]
+                index["partitions"][month] = [min(ids), max(ids), len(rows)]
+            else:
+                if os.path.exists(path):
+                    os.remove(path)
+                index["partitions"].pop(month, None)
+        index["removed"] = sorted(removed - purged)
+        return save_data(index, os.path.join(self.folder, "index.json"))
+
+    def save(self, data : dict, cutoff : int | None = None, removed = (), tombstones : dict[str, set[str]] | None = None):
+        try:
+            if cutoff is None:
+                return self.rebuild(data)
+            index = self.index()
+            tombstones = tombstones or {}
+            locations = set(data["locations"]) - set(tombstones.get("locations", ()))
+            resources = set(data["resources"]) - set(tombstones.get("resources", ()))
+            added = {}
+            if os.path.exists(self.filename):
+                for key, value, _ in stream_data(self.filename):
+                    if key == "reservations":
+                        for reserve in value:
+                            if date.fromisoformat(reserve["end"]).toordinal() < cutoff:
+                                added.setdefault(reserve["end"][:7], []).append(reserve)
+            first = date.fromordinal(cutoff).isoformat()
+            months = set()
+            if index["before"] is not None and cutoff < index["before"]:
+                # Reservations from before the old boundary were loaded into memory
+                # and come back in `data`, so the partitions give them up.
+                months |= {month for month in index["partitions"] if month >= first[:7]}
+            if tombstones.get("locations") or tombstones.get("resources"):
+                months |= set(index["partitions"])
+
+            def keep(reserve):
+                if reserve["end"] >= first or not reserve["location"] in locations:
+                    return False
+                reserve["optionals"] = [optional for optional in reserve["optionals"] if optional in resources]
+                return True
+
+            if not added and not months and not self.lazy and not removed:
+                return save_data(data, self.filename)
+            index["before"] = cutoff
+            if not self.archive(index, added, months, keep, set(removed)):
+                return False
+            return save_data(data, self.filename)
+        except (OSError, KeyError, ValueError):
+            return False
+
+    def rebuild(self, data : dict):
+        # The data holds the whole history, so the partitions are written again
+        # from it with everything that already ended moved out of the main file.
+        cutoff = date.today().toordinal()
+        stale = set(self.index()["partitions"])
+        added, active = {}, []
+        for reserve in data["reservations"]:
+            if date.fromisoformat(reserve["end"]).toordinal() < cutoff:
+                added.setdefault(reserve["end"][:7], []).append(reserve)
+            else:
+                active.append(reserve)
+        if added:
+            index = {"before": cutoff, "partitions": {}, "removed": []}
+            if not self.archive(index, added, set(), lambda reserve: True, set(), fresh=True):
+                return False
+            data["reservations"] = active
+        if not save_data(data, self.filename):
+            return False
+        for month in stale - set(added):
+            os.remove(os.path.join(self.folder, f"{month}.json"))
+        if not added and os.path.isdir(self.folder):
+            if os.path.exists(os.path.join(self.folder, "index.json")):
+                os.remove(os.path.join(self.folder, "index.json"))
+            if not os.listdir(self.folder):
+                os.rmdir(self.folder)
+        self.loaded = {}
+        return True
+
+class SqliteStorage:
+    lazy = True
+
+    def __init__(self, filename : str):
+        self.filename = filename
+
+    def connect(self):
+        connection = sqlite3.connect(self.filename)
+        connection.execute("PRAGMA foreign_keys = ON")
+        connection.executescript(SCHEMA)
+        return connection
+
+    def rows(self, connection, where : str, params : list, limit : int | None = None):
+        query = f"SELECT id, code, start_day, end_day, location FROM reservations WHERE {where} ORDER BY start_day, id"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        reservations = {}
+        for id, code, start, end, location in connection.execute(query, params):
+            reservations[id] = {
+                "ID": code,
+                "start": date.fromordinal(start).isoformat(),
+                "end": date.fromordinal(end).isoformat(),
+                "location": location,
+                "optionals": []
+            }
+        ids = list(reservations)
+        for i in range(0, len(ids), 900):
+            chunk = ids[i:i + 900]
+            optionals = connection.execute(
+                f"""SELECT reservation, resource FROM reservation_resources
+                WHERE optional = 1 AND reservation IN ({", ".join("?" * len(chunk))})
+                ORDER BY rowid""",
+                chunk
+            )
+            for id, resource in optionals:
+                reservations[id]["optionals"].append(resource)
+        return list(reservations.values())
+
+    def stream(self, cutoff : int | None = None, chunk : int = 1000):
+        if not os.path.exists(self.filename):
+            return
+        with closing(self.connect()) as connection:
+            meta = connection.execute("SELECT key, value FROM meta").fetchall()
+            if not meta:
+                return
+            for key, value in meta:
+                yield key, json.loads(value), 0.0
+            reservations = self.rows(connection, "end_day >= ?", [cutoff or 0])
+            for i in range(0, len(reservations), chunk):
+                yield "reservations", reservations[i:i + chunk], min((i + chunk) / len(reservations), 1.0)
+            last = connection.execute("SELECT code FROM reservations ORDER BY id DESC LIMIT 1").fetchone()
+            if last:
+                yield "last_id", last[0], 1.0
+
+    def search(self, start : date | None = None, end : date | None = None, location : str | None = None,
+               resource : str | None = None, before : int | None = None, limit : int | None = None):
+        conditions, params = [], []
+        if location:
+            conditions.append("location = ?")
+            params.append(location)
+        if end:
+            conditions.append("start_day <= ?")
+            params.append(end.toordinal())
+        if start:
+            conditions.append("end_day >= ?")
+            params.append(start.toordinal())
+        if before is not None:
+            conditions.append("end_day < ?")
+            params.append(before)
+        if resource:
+            conditions.append("id IN (SELECT reservation FROM reservation_resources WHERE resource = ?)")
+            params.append(resource)
+        with closing(self.connect()) as connection:
+            return self.rows(connection, " AND ".join(conditions) or "1", params, limit)
+
+    def get(self, code : str):
+        with closing(self.connect()) as connection:
+            found = self.rows(connection, "id = ?", [code_to_id(code)])
+        if found:
+            return found[0]
+        return None
+
+    def save(self, data : dict, cutoff : int | None = None, removed = (), tombstones : dict[str, set[str]] | None = None):
+        tombstones = tombstones or {}
+        try:
+            with closing(self.connect()) as connection, connection:
+                connection.execute("DELETE FROM meta")
+                connection.executemany(
+                    "INSERT INTO meta (key, value) VALUES (?, ?)",
+                    [(key, json.dumps(value, ensure_ascii=False)) for key, value in data.items() if key != "reservations"]
+                )
+                if cutoff is None:
+                    connection.execute("DELETE FROM reservations")
+                else:
+                    connection.execute("DELETE FROM reservations WHERE end_day >= ?", (cutoff,))
+                    connection.executemany("DELETE FROM reservations WHERE id = ?", [(id,) for id in removed])
+                    connection.executemany(
+                        "DELETE FROM reservations WHERE location = ?",
+                        [(location,) for location in tombstones.get("locations", ())]
+                    )
+                    connection.executemany(
+                        "DELETE FROM reservation_resources WHERE resource = ?",
+                        [(resource,) for resource in tombstones.get("resources", ())]
+                    )
+                rows, resources = [], []
+                for reserve in data["reservations"]:
+                    id = code_to_id(reserve["ID"])
+                    rows.append((
+                        id,
+                        reserve["ID"],
+                        date.fromisoformat(reserve["start"]).toordinal(),
+                        date.fromisoformat(reserve["end"]).toordinal(),
+                        reserve["location"]
+                    ))
+                    for requisite in data["requisites"][reserve["location"]]:
+                        resources.append((id, requisite, 0))
+                    for optional in reserve["optionals"]:
+                        resources.append((id, optional, 1))
+                connection.executemany(
+                    "INSERT INTO reservations (id, code, start_day, end_day, location) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                connection.executemany(
+                    "INSERT INTO reservation_resources (reservation, resource, optional) VALUES (?, ?, ?)",
+                    resources
+                )
+            return True
+        except (sqlite3.Error, KeyError, ValueError):
+            return False
+
+class BinaryStorage:
+    # The snapshot is mapped rather than read, so history that ended before the
+    # cutoff is searched in place and only live reservations become objects.
+    lazy = True
+
+    def __init__(self, filename : str):
+        self.filename = filename
+        self.loaded = None
+
+    def snapshot(self):
+        if not os.path.exists(self.filename):
+            return None
+        info = os.stat(self.filename)
+        stamp = (info.st_ino, info.st_mtime_ns, info.st_size)
+        if self.loaded is None or self.loaded[0] != stamp:
+            self.loaded = (stamp, Snapshot(self.filename), None)
+        return self.loaded[1]
+
+    def release(self):
+        # A file that is still mapped cannot be replaced on Windows, so the
+        # mapping is closed before the snapshot is written again.
+        if self.loaded is not None:
+            try:
+                self.loaded[1].close()
+            except BufferError:
+                # A reader still holds columns of it, the mapping goes with them.
+                pass
+            self.loaded = None
+
+    def table(self):
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return ReservationTable(Interner(), Interner())
+        stamp, _, table = self.loaded
+        if table is None:
+            table = ReservationTable.columns(
+                Interner(snapshot.meta["location_table"]),
+                Interner(snapshot.meta["resource_table"]),
+                snapshot.ids, snapshot.starts, snapshot.ends, snapshot.location_ids, snapshot.masks()
+            )
+            self.loaded = (stamp, snapshot, table)
+        return table
+
+    def stream(self, cutoff : int | None = None):
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return
+        for key, value in snapshot.meta.items():
+            if not key in ("location_table", "resource_table"):
+                yield key, copy.deepcopy(value), 0.0
+        rows = np.flatnonzero(snapshot.ends >= (cutoff or 0))
+        yield "columns", {
+            "locations": snapshot.meta["location_table"],
+            "resources": snapshot.meta["resource_table"],
+            "ids": snapshot.ids[rows],
+            "starts": snapshot.starts[rows],
+            "ends": snapshot.ends[rows],
+            "location_ids": snapshot.location_ids[rows],
+            "optionals": snapshot.masks(rows)
+        }, 1.0
+        if snapshot.rows:
+            yield "last_id", id_to_code(int(snapshot.ids.max())), 1.0
+
+    def search(self, start : date | None = None, end : date | None = None, location : str | None = None,
+               before : int | None = None, limit : int | None = None):
+        return self.table().search(start, end, location, before, limit)
+
+    def get(self, code : str):
+        return self.table().get(code)
+
+    def save(self, data : dict, cutoff : int | None = None, removed = (), tombstones : dict[str, set[str]] | None = None):
+        if cutoff is None:
+            self.release()
+            return save_binary(data, self.filename)
+        try:
+            snapshot = self.snapshot()
+        except ValueError:
+            return False
+        locations, resources, (ids, starts, ends, places, masks) = columns(data)
+        if snapshot is not None and snapshot.rows:
+            # History comes from the previous snapshot, everything else from
+            # `data`, with names moved to the new string tables.
+            # Tombstoned names may have been added again, so they are matched
+            # by the deletion rather than by whether the name exists now.
+            tombstones = tombstones or {}
+            kept = set(data["locations"]) - set(tombstones.get("locations", ()))
+            names = snapshot.meta["location_table"]
+            lookup = np.array([locations[name] if name in kept else -1 for name in names], dtype=np.int32)
+            old = lookup[snapshot.location_ids]
+            rows = np.flatnonzero((snapshot.ends < cutoff) & (old >= 0) & ~np.isin(snapshot.ids, list(removed)))
+            dropped = set(tombstones.get("resources", ()))
+            current = {name: resources[name] for name in data["resources"] if not name in dropped}
+            ids = np.concatenate((snapshot.ids[rows], ids))
+            starts = np.concatenate((snapshot.starts[rows], starts))
+            ends = np.concatenate((snapshot.ends[rows], ends))
+            places = np.concatenate((old[rows], places))
+            masks = np.concatenate((remap_masks(snapshot.masks(rows), snapshot.meta["resource_table"], current), masks))
+        # Everything kept from the old snapshot was copied out above.
+        snapshot = None
+        self.release()
+        words = (len(resources) + 63) // 64
+        return write_columns(self.filename, metadata(data, locations, resources), ids, starts, ends, places, encode_masks(masks, words))